@@ -0,0 +1,414 @@
+# MIT License
+#
+# Copyright (c) 2021 Niall McCarroll
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Benchmarks for termplot2d.py, timing the load, coarsen and render pipeline on synthetic netcdf4 datasets.
+
+    python benchmark.py run --output results.json
+    python benchmark.py compare baseline.json results.json
+    python benchmark.py kernels --sizes 4000,8000
+"""
+
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+termplot2d_path = os.path.join(here, "termplot2d.py")
+
+plot_width = 200
+plot_height = 60
+
+# the metrics compared between runs, all of which are better when lower
+metrics = ["loadvar_s", "plotvar_s", "render_s", "colour_lookup_s", "cli_s", "peak_rss_mb", "cli_peak_rss_mb",
+           "output_bytes"]
+
+
+def get_cases(sizes):
+    """
+    get the benchmark cases, varying one property of a base case at a time
+    :param sizes: the grid sizes to benchmark, each grid is size x size
+    :return: a list of dictionaries describing each case
+    """
+    cases = []
+    for size in sizes:
+        base = {"size": size, "dtype": "float32", "nan_fraction": 0.1, "order": "yx", "extra_dims": 0}
+        variations = [{}, {"dtype": "float64"}, {"dtype": "int16"}, {"nan_fraction": 0.0}, {"nan_fraction": 0.9},
+                      {"order": "xy"}, {"extra_dims": 2}]
+        for variation in variations:
+            case = dict(base)
+            case.update(variation)
+            case["name"] = "%d_%s_nan%g_%s_extra%d" % (
+                case["size"], case["dtype"], case["nan_fraction"], case["order"], case["extra_dims"])
+            cases.append(case)
+    return cases
+
+
+def create_dataset(path,case):
+    """
+    create a synthetic netcdf4 dataset for a case, writing it in blocks of rows to limit memory use
+    :param path: the path of the file to create
+    :param case: a dictionary describing the case
+    """
+    import netCDF4
+    import numpy as np
+
+    size = case["size"]
+    rng = np.random.default_rng(0)
+    with netCDF4.Dataset(path, "w") as ds:
+        extra_dims = ["extra%d" % index for index in range(case["extra_dims"])]
+        for dim in extra_dims:
+            ds.createDimension(dim, 2)
+        ds.createDimension("lat", size)
+        ds.createDimension("lon", size)
+        ds.createVariable("lat", "f8", ("lat",))[:] = np.linspace(-90, 90, size)
+        ds.createVariable("lon", "f8", ("lon",))[:] = np.linspace(-180, 180, size)
+
+        xy_dims = ("lat", "lon") if case["order"] == "yx" else ("lon", "lat")
+        if case["dtype"] == "int16":
+            # packed integers, decoded by xarray to floats with missing values
+            v = ds.createVariable("data", "i2", tuple(extra_dims) + xy_dims, fill_value=-32768)
+            v.scale_factor = 0.0001
+        else:
+            v = ds.createVariable("data", "f4" if case["dtype"] == "float32" else "f8",
+                                  tuple(extra_dims) + xy_dims, fill_value=np.nan)
+        v.set_auto_maskandscale(True)
+
+        block_rows = max(1, 2 ** 24 // size)
+        x = np.linspace(0, 4 * np.pi, size)
+        fixed = (0,) * len(extra_dims)
+        for start in range(0, size, block_rows):
+            rows = np.arange(start, min(size, start + block_rows))
+            block = np.sin(x[None, :] + rows[:, None] * 4 * np.pi / size) * np.cos(rows[:, None] * np.pi / size)
+            if case["nan_fraction"] > 0:
+                block = np.ma.masked_array(block, mask=rng.random(block.shape) < case["nan_fraction"])
+            if case["order"] == "yx":
+                v[fixed + (slice(start, start + len(rows)), slice(None))] = block
+            else:
+                v[fixed + (slice(None), slice(start, start + len(rows)))] = block.T
+
+
+def wait_for(process):
+    """
+    wait for a child process to exit
+    :param process: a subprocess.Popen object
+    :return: (stdout,peak_rss_mb) where stdout is the bytes written to the standard output
+    """
+    stdout = process.stdout.read()
+    (_, _, rusage) = os.wait4(process.pid, 0)
+    process.returncode = 0
+    # ru_maxrss is in kilobytes on linux and bytes on macos
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return (stdout, rusage.ru_maxrss / scale)
+
+
+def measure_case(path,repeat):
+    """
+    time the stages of plotting a dataset, in the current process
+    :param path: the path of the dataset
+    :param repeat: the number of times to repeat each timing, the fastest is reported
+    :return: dictionary of timings in seconds
+    """
+    import numpy as np
+    sys.path.insert(0, here)
+    from termplot2d import TermPlotter, open_dataset
+
+    timings = {"loadvar_s": None, "plotvar_s": None, "render_s": None, "colour_lookup_s": None}
+    rng = np.random.default_rng(0)
+    colours = [tuple(int(c) for c in rgb) for rgb in rng.integers(0, 256, (2000, 3))]
+    for _ in range(repeat):
+        with open_dataset(path) as ds:
+            tp = TermPlotter(ds, "blue,green,red", "black", "lon", "lat", plot_width, plot_height, None, None, True)
+
+            start = time.perf_counter()
+            loaded = tp.loadvar(ds, "data")
+            loadvar_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            tp.plotvar(ds, "data")
+            plotvar_s = time.perf_counter() - start
+
+            # render the plot from the loaded variable, without reading it again
+            start = time.perf_counter()
+            tp.plotvar(ds, "data", loaded=loaded)
+            render_s = time.perf_counter() - start
+
+            # search for colours that are not yet cached
+            tp.cached_colours = {}
+            start = time.perf_counter()
+            for (r, g, b) in colours:
+                tp.getClosestColourCode(r, g, b)
+            colour_lookup_s = time.perf_counter() - start
+
+        for (name, value) in (("loadvar_s", loadvar_s), ("plotvar_s", plotvar_s), ("render_s", render_s),
+                              ("colour_lookup_s", colour_lookup_s)):
+            if timings[name] is None or value < timings[name]:
+                timings[name] = value
+    return timings
+
+
+def run_case(path,repeat):
+    """
+    benchmark a dataset, timing each stage in a separate process and an end-to-end run of the command line
+    :param path: the path of the dataset
+    :param repeat: the number of times to repeat each timing, the fastest is reported
+    :return: dictionary of metrics
+    """
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "_measure", path, str(repeat)],
+                               stdout=subprocess.PIPE)
+    (stdout, peak_rss_mb) = wait_for(process)
+    result = json.loads(stdout)
+    result["peak_rss_mb"] = peak_rss_mb
+
+    result.update(run_cli(path, repeat))
+    return result
+
+
+def run_cli(path,repeat,backend="auto"):
+    """
+    time an end-to-end run of the command line
+    :param path: the path of the dataset
+    :param repeat: the number of times to repeat the run, the fastest is reported
+    :param backend: the backend used to read the dataset
+    :return: dictionary of metrics
+    """
+    result = {}
+    env = dict(os.environ, TERM="xterm-256color")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, termplot2d_path, path, "-v", "data", "-x", "lon", "-y", "lat",
+                                    "--plot-width", str(plot_width), "--plot-height", str(plot_height),
+                                    "--backend", backend], stdout=subprocess.PIPE, env=env)
+        (stdout, cli_peak_rss_mb) = wait_for(process)
+        cli_s = time.perf_counter() - start
+        if "cli_s" not in result or cli_s < result["cli_s"]:
+            result["cli_s"] = cli_s
+        result["cli_peak_rss_mb"] = cli_peak_rss_mb
+        result["output_bytes"] = len(stdout)
+    return result
+
+
+def run(args):
+    # numpy and xarray are only imported in child processes, which would otherwise inherit the memory they use
+    import platform
+    import tempfile
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    data_dir = args.data_dir if args.data_dir else tempfile.mkdtemp(prefix="termplot2d_bench_")
+    os.makedirs(data_dir, exist_ok=True)
+
+    results = []
+
+    # time from starting python to finishing a small plot, which is dominated by imports
+    case = {"size": 100, "dtype": "float32", "nan_fraction": 0.1, "order": "yx", "extra_dims": 0}
+    path = os.path.join(data_dir, "cold_start.nc")
+    if not os.path.exists(path):
+        subprocess.run([sys.executable, os.path.abspath(__file__), "_create", path, json.dumps(case)], check=True)
+    for backend in ["auto", "xarray"]:
+        name = "cold_start_" + backend
+        if args.filter and args.filter not in name:
+            continue
+        result = run_cli(path, max(5, args.repeat), backend)
+        result.update({"case": name, "params": case})
+        results.append(result)
+        print("%-40s cli %7.3fs rss %7.1fMB" % (name, result["cli_s"], result["cli_peak_rss_mb"]))
+    if not args.data_dir:
+        os.remove(path)
+
+    for case in get_cases(sizes):
+        if args.filter and args.filter not in case["name"]:
+            continue
+        path = os.path.join(data_dir, case["name"] + ".nc")
+        if not os.path.exists(path):
+            subprocess.run([sys.executable, os.path.abspath(__file__), "_create", path, json.dumps(case)], check=True)
+        result = run_case(path, args.repeat)
+        result.update({"case": case["name"], "params": case})
+        results.append(result)
+        print("%-40s loadvar %8.3fs plotvar %8.3fs render %7.4fs colours %7.3fs cli %7.3fs rss %7.1fMB out %8d" % (
+            case["name"], result["loadvar_s"], result["plotvar_s"], result["render_s"], result["colour_lookup_s"],
+            result["cli_s"], result["peak_rss_mb"], result["output_bytes"]))
+        if not args.data_dir:
+            os.remove(path)
+
+    versions = subprocess.run([sys.executable, "-c", "import numpy, xarray; print(numpy.__version__, xarray.__version__)"],
+                              stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+    report = {"meta": {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                       "numpy": versions[0], "xarray": versions[1], "platform": platform.platform(),
+                       "cpus": os.cpu_count(), "plot_width": plot_width, "plot_height": plot_height},
+              "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("results written to %s" % args.output)
+
+
+def time_kernel(kernel,repeat):
+    """
+    time a kernel and measure the memory it allocates, in the current process
+    :param kernel: a function with no arguments
+    :param repeat: the number of times to repeat the timing, the fastest is reported
+    :return: (seconds,peak_mb) where peak_mb is the peak memory allocated by the kernel, traced in a separate run
+    """
+    import tracemalloc
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        kernel()
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    kernel()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (min(timings), peak / 1024 ** 2)
+
+
+def kernels(args):
+    """
+    time the downsampling kernels for each reduction against xarray's coarsen, on random float32 grids with 10%
+    missing values (and categorical values for the mode reduction)
+    """
+    import numpy as np
+    import xarray as xr
+    sys.path.insert(0, here)
+    from termplot2d import Downsampler
+
+    rng = np.random.default_rng(0)
+    results = []
+    print("%-24s %8s %10s %10s %8s %10s %10s" % (
+        "case", "cells", "kernel_s", "xarray_s", "speedup", "kernel_mb", "xarray_mb"))
+    for size in [int(size) for size in args.sizes.split(",")]:
+        (height, width) = (size // 2, size)
+        continuous = rng.random((height, width), dtype=np.float32)
+        categorical = rng.integers(0, 4, (height, width)).astype(np.float32)
+        for data in (continuous, categorical):
+            data[rng.random((height, width)) < 0.1] = np.nan
+        for reduction in Downsampler.reductions:
+            data = categorical if reduction == "mode" else continuous
+            downsampler = Downsampler(reduction, Downsampler.getEdges(height, plot_height),
+                                      Downsampler.getEdges(width, plot_width), data.dtype)
+            (kernel_s, kernel_mb) = time_kernel(lambda: downsampler.downsample(data), args.repeat)
+
+            # xarray coarsens with windows of a whole number of rows and columns, padding the edges, and has no
+            # equivalent of the nearest and mode reductions
+            arr = xr.DataArray(data, dims=("y", "x"))
+            windows = {"y": math.ceil(height / plot_height), "x": math.ceil(width / plot_width)}
+            xarray_kernels = {"mean": lambda: arr.coarsen(windows, boundary="pad").mean(skipna=True).data,
+                              "max": lambda: arr.coarsen(windows, boundary="pad").max(skipna=True).data,
+                              "min": lambda: arr.coarsen(windows, boundary="pad").min(skipna=True).data}
+            (xarray_s, xarray_mb) = (None, None)
+            if reduction in xarray_kernels:
+                (xarray_s, xarray_mb) = time_kernel(xarray_kernels[reduction], args.repeat)
+
+            name = "%dx%d_%s" % (height, width, reduction)
+            results.append({"case": name, "kernel_s": kernel_s, "xarray_s": xarray_s,
+                            "kernel_mb": kernel_mb, "xarray_mb": xarray_mb})
+            print("%-24s %8s %10.4f %10s %8s %10.1f %10s" % (
+                name, "%dx%d" % downsampler.shape, kernel_s, "%.4f" % xarray_s if xarray_s else "-",
+                "%.1fx" % (xarray_s / kernel_s) if xarray_s else "-", kernel_mb,
+                "%.1f" % xarray_mb if xarray_mb else "-"))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "numpy": np.__version__,
+                                "xarray": xr.__version__, "plot_width": plot_width, "plot_height": plot_height},
+                       "results": results}, f, indent=2)
+        print("results written to %s" % args.output)
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = {result["case"]: result for result in json.load(f)["results"]}
+    with open(args.results) as f:
+        results = {result["case"]: result for result in json.load(f)["results"]}
+
+    regressions = 0
+    print("%-40s %-16s %12s %12s %8s" % ("case", "metric", "baseline", "result", "change"))
+    for case in results:
+        if case not in baseline:
+            continue
+        for metric in metrics:
+            (old, new) = (baseline[case].get(metric), results[case].get(metric))
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            # ignore small absolute differences in timings, which are dominated by noise
+            flagged = change > args.threshold and not (metric.endswith("_s") and new - old < args.min_seconds)
+            regressions += flagged
+            print("%-40s %-16s %12.4g %12.4g %+7.1f%%%s" % (
+                case, metric, old, new, 100 * change, " REGRESSION" if flagged else ""))
+
+    print("%d regression(s) found" % regressions)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) == 4 and sys.argv[1] == "_measure":
+        # internal: measure a case in a separate process so that its peak memory use can be recorded
+        print(json.dumps(measure_case(sys.argv[2], int(sys.argv[3]))))
+        sys.exit(0)
+
+    if len(sys.argv) == 4 and sys.argv[1] == "_create":
+        # internal: create a dataset in a separate process
+        create_dataset(sys.argv[2], json.loads(sys.argv[3]))
+        sys.exit(0)
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmarks for termplot2d.py")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--output", default="benchmark_results.json", help="path of the JSON results file")
+    run_parser.add_argument("--sizes", default="1000,5000",
+                help="comma separated list of grid sizes, each grid is size x size, eg 1000,5000,20000")
+    run_parser.add_argument("--repeat", type=int, default=3,
+                help="the number of times to repeat each timing, the fastest is reported")
+    run_parser.add_argument("--filter", help="only run cases whose names contain this string")
+    run_parser.add_argument("--data-dir",
+                help="directory to create and keep the synthetic datasets in, by default they are created in a "+
+                     "temporary directory and removed after use")
+
+    compare_parser = subparsers.add_parser("compare", help="compare results against a baseline, flagging regressions")
+    compare_parser.add_argument("baseline", help="path of the baseline JSON results file")
+    compare_parser.add_argument("results", help="path of the JSON results file to compare")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                help="flag metrics that are more than this fraction worse than the baseline (default 0.1)")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.005,
+                help="ignore timings that are worse by less than this many seconds (default 0.005)")
+
+    kernels_parser = subparsers.add_parser("kernels",
+                help="time the downsampling kernels for each reduction against xarray's coarsen")
+    kernels_parser.add_argument("--sizes", default="4000,8000",
+                help="comma separated list of grid widths, each grid is size/2 x size (default 4000,8000)")
+    kernels_parser.add_argument("--repeat", type=int, default=3,
+                help="the number of times to repeat each timing, the fastest is reported")
+    kernels_parser.add_argument("--output", help="path of a JSON file to write the timings to")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "kernels":
+        kernels(args)
+    else:
+        compare(args)
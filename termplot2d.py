@@ -23,10 +23,10 @@
 import os
 
 import numpy as np
-import xarray as xr
 import math
 
 import sys
+import threading
 
 class TermPlotter:
 
@@ -121,11 +121,50 @@ class TermPlotter:
 
     reset_escape_code = "\u001b[0m"
 
-    def __init__(self,ds,colour_map,missing_colour,x_dimension,y_dimension,plot_width,plot_height,min_value,max_value,flip):
+    # escape codes that set the background to each of the ansi colours, indexed by colour code
+    bg_escape_codes = np.array(["\u001b[48;5;" + str(code) + "m" for code in range(256)], dtype=object)
+
+    # shorter escape code parameters for the first 16 ansi colours
+    short_bg_params = ["4" + str(code) for code in range(8)] + ["10" + str(code) for code in range(8)]
+    short_fg_params = ["3" + str(code) for code in range(8)] + ["9" + str(code) for code in range(8)]
+
+    # compact escape codes that set the background to each of the ansi colours, indexed by colour code
+    compact_bg_escape_codes = np.array(["\u001b[" + params + "m" for params in short_bg_params] +
+                                       ["\u001b[48;5;" + str(code) + "m" for code in range(16, 256)], dtype=object)
+
+    # ways of encoding the plotted cells as text:
+    #   plain - each row is encoded separately, with a colour escape at the start of each run of colour
+    #   compact - shorter escapes for the first 16 colours, and colours carry over from one row to the next
+    #   halfblock - like compact, but displays two rows of data in each row of text using the upper half block
+    #               character, with the foreground colour for the upper row and the background for the lower row
+    #   text - no colours, each cell is a character from text_ramp, from low to high values, or a space if missing
+    encodings = ["plain", "compact", "halfblock", "text"]
+
+    text_ramp = ".:-=+*#%@"
+
+    # the number of graduations in the colour scale
+    colour_count = 32
+
+    # the memory used by the blocks read at any one time from memory mapped and Zarr arrays, unless max_memory is set
+    block_memory = 64 * 1024 ** 2
+
+    # the number of fixed width bins in the histograms used by the percentile and histeq scales
+    histogram_bins = 1024
+
+    # the histeq scale equalises values between these percentiles, so that outliers do not take up most of the bins
+    histeq_percentiles = (0.1, 99.9)
+
+    # the ansi colours as an array, for vectorised searches for the closest colour
+    ansi_palette = np.array(ansi_colours, dtype=np.int32)
+
+    def __init__(self,ds,colour_map,missing_colour,x_dimension,y_dimension,plot_width,plot_height,min_value,max_value,flip,truecolour=False,
+                 fast=False,sample_stride=None,max_memory=None,workers=None,cache=None,
+                 indices=None,encoding="plain",encoding_stats=False,profiler=None,tiles=None,shared_range=False,
+                 scale="linear",array_cache=None,reduction="mean"):
         """
         Create a TerminalPlotter.  Call the plot method of a TerminalPlotter instance to generate plots.
 
-        :param ds: an xarray dataset
+        :param ds: an xarray dataset, or a NetCDFSource (see open_dataset)
         :param colour_map: the name of the colour map to use, either comma separated colour list or "rgb"
         :param missing_colour: name of a colour to represent a missing value
         :param x_dimension: the name of the dimension to plot on the x-axis
@@ -135,26 +174,46 @@ class TermPlotter:
         :param min_value: the minimum value to plot on the colour scale (or None to automatically select)
         :param plot_height: the maximum value to plot on the colour scale (or None to automatically select)
         :param flip: set to true if the first rows in the image should appear at the bottom of the plot
+        :param truecolour: set to true to emit 24-bit colours rather than the closest colours in the ANSI palette
+        :param fast: set to true to read only a strided sample of each variable, roughly one value per plotted cell
+        :param sample_stride: read only every Nth value along the x and y dimensions (or None to read all values)
+        :param max_memory: read and coarsen variables in row blocks using at most this many bytes (or None)
+        :param workers: the number of threads used to read and coarsen row blocks (or None to use all cores)
+        :param cache: an OverviewCache used to store and reuse downsampled copies of variables (or None)
+        :param indices: dictionary mapping from the names of dimensions other than x and y to the index to plot,
+                        dimensions not included are plotted at index 0
+        :param encoding: how to encode the plotted cells, one of TermPlotter.encodings
+        :param encoding_stats: set to true to report the size of the encoded cells under each plot
+        :param profiler: a PlotProfiler used to record the time taken by each stage of plotting (or None)
+        :param tiles: (rows,columns) to plot several variables on each page in a grid of tiles (or None)
+        :param shared_range: set to true to use the same colour scale range for every tile on a page
+        :param scale: how values are mapped to the colour scale: "linear" from the minimum to the maximum value,
+                      "percentile:<low>,<high>" linearly between two percentiles of the values, clipping values
+                      outside them, or "histeq" to equalise the histogram of the values
+        :param array_cache: an ArrayCache used to keep coarsened variables in memory for reuse (or None)
+        :param reduction: how the values in each plotted cell are reduced, one of Downsampler.reductions
         """
         self.ds = ds
         self.colour_map = colour_map
+        self.truecolour = truecolour
         self.cached_colours = {} # mapping from (r,g,b) fractions to the closest ANSI colours
+        self.profiler = profiler
         self.data = None
         self.height = None
         self.width = None
         self.x_dimension = x_dimension
         self.y_dimension = y_dimension
 
-        # if x and y dimensions are not defined, try to guess them
+        # if x and y dimensions are not defined, try to guess them from the variables and dimensions
         if self.x_dimension == "":
             for x_dimension in TermPlotter.default_x:
-                if x_dimension in self.ds.variables:
+                if x_dimension in self.ds.variables or x_dimension in self.ds.sizes:
                     self.x_dimension = x_dimension
                     break
 
         if self.y_dimension == "":
             for y_dimension in TermPlotter.default_y:
-                if y_dimension in self.ds.variables:
+                if y_dimension in self.ds.variables or y_dimension in self.ds.sizes:
                     self.y_dimension = y_dimension
                     break
 
@@ -167,16 +226,16 @@ class TermPlotter:
             sys.exit(-1)
 
         if self.colour_map != "rgb":
-            self.compute_colour_scale(32)
+            self.compute_colour_scale(TermPlotter.colour_count)
         else:
             self.colour_scale = None
 
         if missing_colour in TermPlotter.webcolors:
             (r,g,b) = TermPlotter.webcolors[missing_colour]
-            self.missing_colour_code = self.getClosestColourCode(r,g,b)
+            self.missing_colour_code = self.getRGBColourCode(r,g,b)
         else:
             print("colour to represent missing (%s) not recognized, using black"%(missing_colour))
-            self.missing_color_code = 0
+            self.missing_colour_code = self.getRGBColourCode(0,0,0)
 
         self.plot_width = plot_width
         self.plot_height = plot_height
@@ -184,12 +243,47 @@ class TermPlotter:
         self.max_value = max_value
 
         if not self.plot_height or not self.plot_width:
-            tsize = os.get_terminal_size()
+            # falls back to 80x24 when there is no terminal, for example when run from cron
+            import shutil
+            tsize = shutil.get_terminal_size()
             if not self.plot_height:
                 self.plot_height = tsize.lines - 2
             if not self.plot_width:
                 self.plot_width = tsize.columns - 1
         self.flip = flip
+        self.fast = fast
+        self.sample_stride = sample_stride
+        self.max_memory = max_memory
+        self.workers = workers
+        self.cache = cache
+        self.array_cache = array_cache
+        self.indices = indices if indices else {}
+        self.encoding = encoding
+        self.encoding_stats = encoding_stats
+        self.tiles = tiles
+        self.shared_range = shared_range
+        self.scale = scale
+        self.percentiles = None
+        if scale.startswith("percentile:"):
+            try:
+                self.percentiles = tuple(float(p) for p in scale[len("percentile:"):].split(","))
+            except ValueError:
+                self.percentiles = ()
+            if len(self.percentiles) != 2 or not 0 <= self.percentiles[0] < self.percentiles[1] <= 100:
+                print("scale %s not recognized, use percentile:<low>,<high> with 0 <= low < high <= 100" % scale)
+                sys.exit(-1)
+        elif scale not in ("linear", "histeq"):
+            print("scale %s not recognized, use linear, percentile:<low>,<high> or histeq" % scale)
+            sys.exit(-1)
+        if reduction not in Downsampler.reductions:
+            print("reduction %s not recognized, use one of %s" % (reduction, ",".join(Downsampler.reductions)))
+            sys.exit(-1)
+        self.reduction = reduction
+        # with half block characters, each terminal row displays two rows of data
+        self.cell_rows = 2 if encoding == "halfblock" else 1
+        if encoding == "text":
+            # in text mode colour codes are indices into the colour scale, and missing values are -1
+            self.missing_colour_code = -1
 
     def compute_colour_scale(self,colour_count):
         """
@@ -217,81 +311,455 @@ class TermPlotter:
         :param var_names: a list of variable names to plot
         :return: the contents of the plots, concatenated if multiple plots are generated
         """
+        return [self.plotPage(page) for page in self.getPages(var_names)]
+
+    def getPages(self,var_names):
+        """
+        work out the pages needed to plot one or more variables, without loading any data
+        :param var_names: a list of variable names to plot, or an empty list to plot all suitable variables
+        :return: a list of pages, each a variable name, a list of (red,green,blue) variable names or, when plotting
+                 in tiles, a tuple of the variable names in each tile
+        """
         if var_names == []:
             # no variables specified, plot all variables with the specified x and y dimensions?
             for var_name in self.ds.variables:
                 v = self.ds.variables[var_name]
                 if self.x_dimension in v.dims and self.y_dimension in v.dims:
                     var_names.append(var_name)
-        plots = []
-        for var_name in var_names:
-            plots.append(self.plotvar(self.ds,var_name))
-        return plots
+        if self.colour_map == "rgb":
+            # variables are plotted as red, green and blue channels of a composite image
+            if len(var_names) % 3 != 0:
+                print("rgb colour map requires variables in groups of three (red, green, blue)")
+                sys.exit(-1)
+            return [var_names[index:index+3] for index in range(0,len(var_names),3)]
+        if self.tiles:
+            # variables are plotted in a grid of tiles, filling each page
+            tile_count = self.tiles[0] * self.tiles[1]
+            return [tuple(var_names[index:index+tile_count]) for index in range(0,len(var_names),tile_count)]
+        return list(var_names)
+
+    def plotPage(self,page):
+        """
+        make the plot for a page
+        :param page: a page returned by getPages
+        :return: the contents of the plot
+        """
+        if isinstance(page, list):
+            return self.plotrgb(self.ds,page)
+        if isinstance(page, tuple):
+            return self.plottiles(self.ds,page)
+        return self.plotvar(self.ds,page)
 
-    def plotvar(self,ds,var_name):
+    def plotvar(self,ds,var_name,indices=None,loaded=None):
         """
         make a plot of a single variable
         :param ds: an xarray dataset
         :param var_name: the name of a variable within the dataset
-        :return: (nan_fraction,minval,maxval,data,original_height,original_width)
+        :param indices: dictionary mapping from dimension names to the index to plot, overriding the plotter's indices
+        :param loaded: the result of calling loadvar with the same arguments, if the variable is already loaded
+        :return: the contents of the plot
         """
         # get the dataset, normalised and coarsened to fit the terminal
-        (nan_fraction,minval,maxval,data,original_height,original_width) = self.loadvar(ds,var_name)
+        if loaded is None:
+            loaded = self.loadvar(ds,var_name,indices)
+        (nan_fraction,minval,maxval,data,original_height,original_width) = loaded
 
-        (height, width) = data.shape
+        # construct the main plot
+        with self.profile("quantize", var_name):
+            codes = self.getCodes(data)
+        with self.profile("render", var_name):
+            s = self.renderCodes(codes)
+        stats = self.getEncodingStats(s, codes) if self.encoding_stats else ""
 
-        # construct the colour bar
-        def getColourBar(minval,maxval):
-            cbar = ""
-            if minval < maxval:
-                for index in range(len(self.colour_scale)):
-                    cbar += self.getColourBGString(self.getColourCode(index))
-            else:
-                # where max=min, all non-missing normalised data is set to 0.5 set the colour bar to the midpoint
-                index = math.floor(len(self.colour_scale) * 0.5)
-                code = self.getColourCode(index)
-                for index in range(len(self.colour_scale)):
-                    cbar += self.getColourBGString(code)
-            cbar += TermPlotter.reset_escape_code
-            return cbar
+        # label the plot with any indices selected for the other dimensions
+        label = var_name + self.getIndexLabel(ds,var_name,indices)
 
-        # construct the main plot
-        s = ""
-        for y in range(0, height):
-            last_code = None
-            for x in range(0, width):
-                v = data[y, x]
-                if math.isnan(v):
-                    code = self.missing_colour_code
-                else:
-                    index = math.floor(len(self.colour_scale) * v)
-                    code = self.getColourCode(index)
-                if last_code is not None and code == last_code:
-                    s += " "
-                else:
-                    s += self.getColourBGString(code)
-                    last_code = code
-            s += TermPlotter.reset_escape_code
-            s += "\n"
+        # statistics estimated from a strided sample are labelled as approximate
+        (stride_y, stride_x) = self.getSampleStrides(original_height, original_width)
+        if stride_y > 1 or stride_x > 1:
+            approx = "~"
+            sampled = ",sampled:%dx%d" % (stride_x, stride_y)
+        else:
+            approx = ""
+            sampled = ""
 
         if math.isnan(minval) or math.isnan(maxval):
             # corner case, all values are missing, dont show colour bar
-            s += "%s (w:%d,h:%d) [missing: %.3f%% %s]" % (
-                var_name, original_width, original_height,
-                100 * nan_fraction,
+            s += "%s (w:%d,h:%d%s) [missing: %s%.3f%% %s]" % (
+                label, original_width, original_height, sampled,
+                approx, 100 * nan_fraction,
                 self.getColourBGString(self.missing_colour_code, s=" ", reset=True))
         else:
-            s += "%s (w:%d,h:%d) [%f %s %f] [missing: %.3f%% %s]" % (
-                var_name, original_width, original_height,
-                minval, getColourBar(minval,maxval), maxval, 100 * nan_fraction,
+            s += "%s (w:%d,h:%d%s) [%s%f %s %s%f]%s [missing: %s%.3f%% %s]" % (
+                label, original_width, original_height, sampled,
+                approx if self.min_value is None else "", minval, self.getColourBar(minval,maxval),
+                approx if self.max_value is None else "", maxval,
+                "" if self.scale == "linear" else " [scale:%s]" % self.scale,
+                approx, 100 * nan_fraction,
                 self.getColourBGString(self.missing_colour_code, s=" ", reset=True))
+        return s + stats
+
+    def getColourBar(self,minval,maxval):
+        """
+        construct the colour bar shown under a plot
+        :param minval: the value at the low end of the colour scale
+        :param maxval: the value at the high end of the colour scale
+        :return: the colour bar, one cell for each colour in the scale
+        """
+        cbar = ""
+        if minval < maxval:
+            for index in range(len(self.colour_scale)):
+                cbar += self.getColourBGString(self.getColourCode(index))
+        else:
+            # where max=min, all non-missing normalised data is set to 0.5 set the colour bar to the midpoint
+            index = math.floor(len(self.colour_scale) * 0.5)
+            code = self.getColourCode(index)
+            for index in range(len(self.colour_scale)):
+                cbar += self.getColourBGString(code)
+        if self.encoding != "text":
+            cbar += TermPlotter.reset_escape_code
+        return cbar
+
+    def plottiles(self,ds,var_names):
+        """
+        make a plot of several variables in a grid of tiles, each variable coarsened to fit its tile.  The variables
+        are loaded concurrently, and the plot is returned as a single string so that it can be written at once.
+        :param ds: an xarray dataset
+        :param var_names: the names of the variables within the dataset, at most one per tile
+        :return: the contents of the plot
+        """
+        import copy
+        from concurrent.futures import ThreadPoolExecutor
+        (rows, columns) = self.tiles
+
+        # each row of tiles is followed by a line of labels, and the colour bar is shown once at the bottom
+        tile_width = max(1, (self.plot_width - (columns - 1)) // columns)
+        tile_height = max(1, (self.plot_height - 1) // rows - 1)
+        tile_plotter = copy.copy(self)
+        tile_plotter.plot_width = tile_width
+        tile_plotter.plot_height = tile_height
+
+        with ThreadPoolExecutor(max_workers=len(var_names)) as executor:
+            loaded = list(executor.map(lambda var_name: tile_plotter.loadvar(ds, var_name), var_names))
+
+        datas = [data for (nan_fraction,minval,maxval,data,original_height,original_width) in loaded]
+        ranges = [(minval, maxval) for (nan_fraction,minval,maxval,data,original_height,original_width) in loaded]
+        if self.shared_range:
+            # renormalise each tile from its own range to the range of all the tiles
+            minvals = [minval for (minval, maxval) in ranges if not math.isnan(minval)]
+            maxvals = [maxval for (minval, maxval) in ranges if not math.isnan(maxval)]
+            shared = (min(minvals), max(maxvals)) if minvals else (np.nan, np.nan)
+            for (index, (minval, maxval)) in enumerate(ranges):
+                if math.isnan(minval) or shared[0] == shared[1]:
+                    continue
+                values = minval + np.asarray(datas[index]) * (maxval - minval)
+                datas[index] = (values - shared[0]) / (shared[1] - shared[0])
+            ranges = [shared] * len(ranges)
+
+        # cells between and around the tiles are left blank
+        blank = -1 if self.encoding == "text" else self.getRGBColourCode(0, 0, 0)
+        s = ""
+        with self.profile("render", "+".join(var_names)):
+            for row in range(rows):
+                row_names = var_names[row * columns:(row + 1) * columns]
+                if not row_names:
+                    break
+                frame = np.full((tile_height * self.cell_rows, columns * (tile_width + 1) - 1), blank)
+                labels = []
+                for (column, var_name) in enumerate(row_names):
+                    index = row * columns + column
+                    codes = self.getCodes(datas[index])[:tile_height * self.cell_rows, :tile_width]
+                    left = column * (tile_width + 1)
+                    frame[:codes.shape[0], left:left + codes.shape[1]] = codes
+                    (nan_fraction, minval, maxval, data, original_height, original_width) = loaded[index]
+                    label = "%s [%.4g,%.4g] missing:%.1f%%" % (
+                        var_name + self.getIndexLabel(ds, var_name), minval, maxval, 100 * nan_fraction)
+                    labels.append(label[:tile_width].ljust(tile_width))
+                s += self.renderCodes(frame) + " ".join(labels).rstrip() + "\n"
+
+        if self.shared_range and not math.isnan(ranges[0][0]):
+            s += "[%f %s %f]" % (ranges[0][0], self.getColourBar(ranges[0][0], ranges[0][1]), ranges[0][1])
+        else:
+            s += "[%s]" % self.getColourBar(0, 1)
+        s += " [missing: %s]" % self.getColourBGString(self.missing_colour_code, s=" ", reset=True)
         return s
 
-    def loadvar(self,ds,var_name):
+    def plotrgb(self,ds,var_names):
+        """
+        make a composite plot of three variables, mapped to the red, green and blue channels
+        :param ds: an xarray dataset
+        :param var_names: the names of the red, green and blue variables within the dataset
+        :return: the contents of the plot
+        """
+        channels = []
+        nan_fractions = []
+        for var_name in var_names:
+            (nan_fraction,minval,maxval,data,original_height,original_width) = self.loadvar(ds,var_name)
+            channels.append(np.asarray(data))
+            nan_fractions.append(nan_fraction)
+
+        if len(set(channel.shape for channel in channels)) != 1:
+            print("unable to combine variables %s with different shapes" % (",".join(var_names)))
+            sys.exit(-1)
+
+        with self.profile("quantize", ",".join(var_names)):
+            # cells are missing if any of the channels is missing
+            rgb = np.stack(channels,axis=-1)
+            missing = np.any(np.isnan(rgb),axis=-1)
+            with np.errstate(invalid="ignore"):
+                rgb = np.clip(np.floor(255 * np.where(np.isnan(rgb), 0, rgb)), 0, 255).astype(np.int32)
+            codes = np.where(missing, self.missing_colour_code, self.getRGBColourCodes(rgb))
+
+        with self.profile("render", ",".join(var_names)):
+            s = self.renderCodes(codes)
+        stats = self.getEncodingStats(s, codes) if self.encoding_stats else ""
+        (stride_y, stride_x) = self.getSampleStrides(original_height, original_width)
+        s += "r:%s g:%s b:%s (w:%d,h:%d%s) [missing: %s%.3f%% %s]" % (
+            var_names[0], var_names[1], var_names[2], original_width, original_height,
+            ",sampled:%dx%d" % (stride_x, stride_y) if stride_y > 1 or stride_x > 1 else "",
+            "~" if stride_y > 1 or stride_x > 1 else "", 100 * max(nan_fractions),
+            self.getColourBGString(self.missing_colour_code, s=" ", reset=True))
+        return s + stats
+
+    def profile(self,stage,var_name=None):
+        """
+        time a stage of plotting, if the plotter has a profiler
+        :param stage: the name of the stage
+        :param var_name: the variable being plotted, or None for stages that are not specific to a variable
+        :return: a context manager yielding a dictionary of measurements for the stage, see PlotProfiler.stage
+        """
+        if self.profiler is None:
+            import contextlib
+            return contextlib.nullcontext({})
+        return self.profiler.stage(stage, var_name)
+
+    def renderData(self,data):
+        """
+        render a normalised array as rows of background coloured cells
+        :param data: a normalised array organised by [y,x], with values in the range 0.0 to 1.0 or NaN for missing
+        :return: a string containing the rendered rows, each ending with a colour reset and a newline
+        """
+        return self.renderCodes(self.getCodes(data))
+
+    def getCodes(self,data):
+        """
+        quantize a normalised array to colour codes
+        :param data: a normalised array organised by [y,x], with values in the range 0.0 to 1.0 or NaN for missing
+        :return: an integer array of colour codes (see getRGBColourCode) organised by [y,x]
+        """
+        data = np.asarray(data)
+
+        # quantize the whole array to colour codes in one pass
+        colour_count = len(self.colour_scale)
+        scale_codes = np.array([self.getColourCode(index) for index in range(colour_count)])
+        missing = np.isnan(data)
+        with np.errstate(invalid="ignore"):
+            indices = np.floor(colour_count * np.where(missing, 0, data))
+        indices = np.clip(indices, 0, colour_count - 1).astype(np.intp)
+        return np.where(missing, self.missing_colour_code, scale_codes[indices])
+
+    def renderCodes(self,codes):
+        """
+        render an array of colour codes as rows of coloured cells, using the plotter's encoding
+        :param codes: an integer array of colour codes (see getRGBColourCode) organised by [y,x]
+        :return: a string containing the rendered rows, each ending with a newline, with colours reset at the end
+        """
+        if self.encoding == "text":
+            return self.encodeText(codes)
+        elif self.encoding == "compact":
+            return self.encodeCompact(codes)
+        elif self.encoding == "halfblock":
+            return self.encodeHalfBlocks(codes)
+        return self.encodePlain(codes)
+
+    def encodePlain(self,codes):
+        """
+        render an array of colour codes as rows of background coloured cells
+        :param codes: an integer array of colour codes (see getRGBColourCode) organised by [y,x]
+        :return: a string containing the rendered rows, each ending with a colour reset and a newline
+        """
+        (height, width) = codes.shape
+        if height == 0 or width == 0:
+            return ""
+
+        # find the runs of cells with the same colour, a new run starts at each row and wherever the colour changes
+        changes = np.ones((height, width), dtype=bool)
+        changes[:, 1:] = codes[:, 1:] != codes[:, :-1]
+        starts = np.flatnonzero(changes)
+        lengths = np.diff(np.append(starts, height * width))
+
+        # emit each run as a colour escape followed by spaces, ending each row with a reset and newline
+        padding = np.array([" " * n for n in range(width + 1)], dtype=object)
+        run_codes = codes.ravel()[starts]
+        if self.truecolour:
+            (unique_codes, inverse) = np.unique(run_codes, return_inverse=True)
+            escapes = np.array([self.getColourBGString(int(code), s="") for code in unique_codes], dtype=object)
+            runs = escapes[inverse] + padding[lengths]
+        else:
+            runs = TermPlotter.bg_escape_codes[run_codes] + padding[lengths]
+        row_ends = np.searchsorted(starts, np.arange(1, height + 1) * width) - 1
+        runs[row_ends] = runs[row_ends] + (TermPlotter.reset_escape_code + "\n")
+        return "".join(runs)
+
+    def encodeCompact(self,codes):
+        """
+        render an array of colour codes as rows of background coloured cells, minimising the size of the output.
+        The colour is only set when it changes, including from the end of one row to the start of the next, so
+        the output should be written to a cleared terminal where it does not need to scroll.
+        :param codes: an integer array of colour codes (see getRGBColourCode) organised by [y,x]
+        :return: a string containing the rendered rows, each ending with a newline, with colours reset at the end
+        """
+        (height, width) = codes.shape
+        if height == 0 or width == 0:
+            return ""
+
+        # runs start at each row, but only need a colour escape where the colour changes
+        flat_codes = codes.ravel()
+        changes = np.ones(height * width, dtype=bool)
+        changes[1:] = flat_codes[1:] != flat_codes[:-1]
+        row_starts = np.zeros((height, width), dtype=bool)
+        row_starts[:, 0] = True
+        starts = np.flatnonzero(changes | row_starts.ravel())
+        lengths = np.diff(np.append(starts, height * width))
+
+        padding = np.array([" " * n for n in range(width + 1)], dtype=object)
+        run_codes = flat_codes[starts]
+        if self.truecolour:
+            (unique_codes, inverse) = np.unique(run_codes, return_inverse=True)
+            escapes = np.array([self.getColourBGString(int(code), s="") for code in unique_codes], dtype=object)[inverse]
+        else:
+            escapes = TermPlotter.compact_bg_escape_codes[run_codes]
+        runs = np.where(changes[starts], escapes, "") + padding[lengths]
+        row_ends = np.searchsorted(starts, np.arange(1, height + 1) * width) - 1
+        runs[row_ends] = runs[row_ends] + "\n"
+        runs[-1] = runs[-1][:-1] + TermPlotter.reset_escape_code + "\n"
+        return "".join(runs)
+
+    def encodeText(self,codes):
+        """
+        render an array of colour scale indices as rows of characters, without colours
+        :param codes: an integer array of colour scale indices organised by [y,x], -1 for missing
+        :return: a string containing the rendered rows, each ending with a newline
+        """
+        characters = np.array([self.getColourBGString(code) for code in range(-1, TermPlotter.colour_count)],
+                              dtype=object)
+        return "".join("".join(row) + "\n" for row in characters[codes + 1])
+
+    def getEscapeParams(self,code,foreground):
+        """
+        get the shortest escape code parameters that set the foreground or background to a colour
+        :param code: the colour code (see getRGBColourCode), or -1 for the terminal's default colour
+        :param foreground: True to set the foreground colour, False to set the background colour
+        :return: the parameters, for example "41" or "48;5;123"
+        """
+        if code < 0:
+            return "39" if foreground else "49"
+        if self.truecolour:
+            return "%s;2;%d;%d;%d" % ("38" if foreground else "48", (code >> 16) & 255, (code >> 8) & 255, code & 255)
+        if code < 16:
+            return TermPlotter.short_fg_params[code] if foreground else TermPlotter.short_bg_params[code]
+        return ("38;5;" if foreground else "48;5;") + str(code)
+
+    def encodeHalfBlocks(self,codes):
+        """
+        render an array of colour codes using half block characters, two rows of data to each row of text.
+        The colours carry over from one row to the next, so the output should be written to a cleared terminal
+        where it does not need to scroll.
+        :param codes: an integer array of colour codes (see getRGBColourCode) organised by [y,x]
+        :return: a string containing the rendered rows, each ending with a newline, with colours reset at the end
+        """
+        (height, width) = codes.shape
+        if height == 0 or width == 0:
+            return ""
+        if height % 2:
+            # the lower half of the last row is left in the terminal's default colour
+            codes = np.concatenate([codes, np.full((1, width), -1, dtype=codes.dtype)])
+        upper = codes[0::2].tolist()
+        lower = codes[1::2].tolist()
+
+        escapes = {}
+        def escape(fg, bg):
+            # set the foreground and/or background, reusing escape codes that have already been built
+            key = (fg, bg)
+            if key not in escapes:
+                params = [self.getEscapeParams(code, foreground) for (code, foreground) in ((fg, True), (bg, False))
+                          if code is not None]
+                escapes[key] = "\u001b[" + ";".join(params) + "m"
+            return escapes[key]
+
+        out = []
+        (fg, bg) = (None, None)
+        for (upper_row, lower_row) in zip(upper, lower):
+            for (top, bottom) in zip(upper_row, lower_row):
+                if top == bottom:
+                    # a space in the background colour, or a full block in the foreground colour
+                    if bg == top:
+                        out.append(" ")
+                    elif fg == top:
+                        out.append("\u2588")
+                    else:
+                        out.append(escape(None, top) + " ")
+                        bg = top
+                else:
+                    # use an upper half block (top in the foreground) or a lower half block (bottom in the
+                    # foreground), whichever needs fewer colour changes
+                    upper_changes = (fg != top) + (bg != bottom)
+                    lower_changes = (fg != bottom) + (bg != top)
+                    if upper_changes <= lower_changes:
+                        (new_fg, new_bg, block) = (top, bottom, "\u2580")
+                    else:
+                        (new_fg, new_bg, block) = (bottom, top, "\u2584")
+                    if new_fg != fg or new_bg != bg:
+                        out.append(escape(new_fg if new_fg != fg else None, new_bg if new_bg != bg else None))
+                        (fg, bg) = (new_fg, new_bg)
+                    out.append(block)
+            out.append("\n")
+        out[-1] = TermPlotter.reset_escape_code + "\n"
+        return "".join(out)
+
+    def getEncodingStats(self,rendered,codes):
+        """
+        describe the size of the encoded cells of a plot
+        :param rendered: the rendered cells
+        :param codes: the array of colour codes that was rendered
+        :return: a line describing the number of bytes, and bytes per cell of data
+        """
+        size = len(rendered.encode("utf-8"))
+        return "\n[encoding %s: %d bytes, %.2f bytes/cell]" % (self.encoding, size, size / max(1, codes.size))
+
+    def getIndexLabel(self,ds,var_name,indices=None):
+        """
+        describe the indices selected for the dimensions of a variable other than x and y
+        :param ds: the xarray dataset
+        :param var_name: the name of a variable in the dataset
+        :param indices: dictionary mapping from dimension names to the index to plot, overriding the plotter's indices
+        :return: a label such as "[time=3]", or an empty string if no indices were selected
+        """
+        selected = self.getIndices(indices)
+        variable = ds[var_name]
+        labels = []
+        for (dim, size) in zip(variable.dims, variable.shape):
+            if dim in selected:
+                labels.append("%s=%d" % (dim, selected[dim] + size if selected[dim] < 0 else selected[dim]))
+        return "[" + ",".join(labels) + "]" if labels else ""
+
+    def getIndices(self,indices=None):
+        """
+        get the indices selected for dimensions other than x and y
+        :param indices: dictionary mapping from dimension names to the index to plot, overriding the plotter's indices
+        :return: dictionary mapping from dimension names to the selected index
+        """
+        selected = dict(self.indices)
+        if indices:
+            selected.update(indices)
+        return selected
+
+    def loadvar(self,ds,var_name,indices=None):
         """
         load and wrangle a variable from the dataset
         :param ds: the xarray dataset
         :param var_name: the name of a variable in the dataset
+        :param indices: dictionary mapping from dimension names to the index to plot, overriding the plotter's indices
         :return: (nan_fraction,minval,maxval,data,original_height,original_width)
         """
         variable = ds[var_name]
@@ -303,53 +771,341 @@ class TermPlotter:
         original_height = variable.shape[y_index]
         original_width = variable.shape[x_index]
 
-        # extract a 2D dataset, setting other indices to 0
+        # in fast/sample mode, read only every Nth value along x and y, the strided slice is passed to the backend
+        (stride_y, stride_x) = self.getSampleStrides(original_height, original_width)
+
+        (arr, fixed_indices) = self.selectvar(ds, var_name, indices, stride_y, stride_x)
+
+        # work out the windows to coarsen the array, so that it fills the plot
+        downsampler = Downsampler(self.reduction,
+                                  Downsampler.getEdges(arr.sizes[self.y_dimension], self.plot_height * self.cell_rows),
+                                  Downsampler.getEdges(arr.sizes[self.x_dimension], self.plot_width), arr.dtype)
+
+        # try to reuse the coarsened array kept in memory from an earlier plot of the same data
+        cached = None
+        cache_key = None
+        if self.array_cache is not None and ds.encoding.get("source"):
+            cache_key = ArrayCache.getKey(ds.encoding["source"], var_name, (self.y_dimension, self.x_dimension),
+                                          fixed_indices, (stride_y, stride_x), self.reduction, downsampler.shape,
+                                          ds.encoding.get("backend", "auto"), ds.encoding.get("layout"))
+            cached = self.array_cache.get(cache_key)
+
+        # try to build the plot from a cached overview of the variable rather than the source data, overviews
+        # hold the means of windows so cannot be used for other reductions
+        coarsened = None
+        if cached is None and self.cache is not None and stride_y == 1 and stride_x == 1 and self.reduction == "mean":
+            (nan_count, coarsened) = self.loadOverview(ds, var_name, fixed_indices, arr, downsampler)
+
+        if cached is not None:
+            (nan_fraction, arr) = cached
+        elif coarsened is not None:
+            nan_fraction = nan_count / arr.size
+            arr = coarsened
+        elif self.max_memory is not None or self.workers is not None or getattr(arr, "streamed", False):
+            # stream the array in row blocks, computing NaN statistics and coarsening each block
+            with self.profile("read+coarsen", var_name) as record:
+                (nan_count, coarsened) = self.coarsenBlocks(arr, downsampler)
+                record.update(bytes=arr.nbytes, shape="%s->%s" % (arr.shape, coarsened.shape))
+            nan_fraction = nan_count / arr.size
+            arr = coarsened
+        else:
+            with self.profile("read", var_name) as record:
+                arr = arr.load()
+                record["bytes"] = arr.nbytes
+
+            # if the array is larger than the plot in either dimension, coarsen the data, getting NaN statistics
+            # before coarsening (estimated from the sample, if sampling)
+            if downsampler.shape != (arr.sizes[self.y_dimension], arr.sizes[self.x_dimension]):
+                with self.profile("coarsen", var_name) as record:
+                    shape = arr.shape
+                    (nan_count, coarsened) = downsampler.downsample(
+                        arr.transpose(self.y_dimension, self.x_dimension).values)
+                    nan_fraction = nan_count / arr.size
+                    # keep the array in the same dimension order as arr
+                    arr = np.transpose(coarsened) if y_index > x_index else coarsened
+                    record["shape"] = "%s->%s" % (shape, arr.shape)
+            else:
+                with self.profile("nan_scan", var_name):
+                    nan_fraction = np.count_nonzero(np.isnan(arr.data)) / arr.size
+                arr = arr.data
+
+        if cache_key is not None and cached is None:
+            self.array_cache.put(cache_key, nan_fraction, arr)
+
+        with self.profile("normalise", var_name):
+            # work out max and min values if not specified explicitly
+            maxval = self.max_value if self.max_value is not None else np.nanmax(arr)
+            minval = self.min_value if self.min_value is not None else np.nanmin(arr)
+
+            if self.scale != "linear" and np.nanmin(arr) < np.nanmax(arr):
+                # scale between percentiles of the values
+                (low, high) = self.percentiles if self.percentiles else TermPlotter.histeq_percentiles
+                if self.min_value is None:
+                    minval = TermPlotter.getPercentile(arr, low)
+                if self.max_value is None:
+                    maxval = TermPlotter.getPercentile(arr, high)
+
+            # normalise the array so that values lie in the range 0.0 to 1.0
+            if minval is None or maxval is None:
+                # corner case: no values in the data
+                pass
+            elif minval == maxval:
+                # edge case: only one value in the data
+                data = np.where(np.isnan(arr), arr, 0.5)
+            elif self.scale == "histeq":
+                # map each value to the fraction of values below it, looking up the cumulative histogram
+                (counts, edges) = self.getHistogram(arr, minval, maxval)
+                cumulative = np.cumsum(counts)
+                lookup = (cumulative - counts / 2) / max(1, cumulative[-1])
+                missing = np.isnan(arr)
+                with np.errstate(invalid="ignore"):
+                    bins = np.floor((np.where(missing, minval, arr) - minval) * (len(counts) / (maxval - minval)))
+                bins = np.clip(bins, 0, len(counts) - 1).astype(np.intp)
+                data = np.where(missing, np.nan, lookup[bins])
+            else:
+                # values outside the range (when clipping at percentiles) are clipped to the colour scale later
+                data = (arr - minval) / (maxval - minval)
+
+            # make sure that array is organised by [y,x]
+            if y_index > x_index:
+                data = np.transpose(data)
+
+            # invert the array if flip specified
+            if self.flip:
+                data = np.flipud(data)
+
+        return (nan_fraction,minval,maxval,data,original_height,original_width)
+
+    def getHistogram(self,arr,minval,maxval):
+        """
+        count the non-NaN values of an array in fixed width bins, without sorting the values
+        :param arr: a numpy array
+        :param minval: the lower edge of the first bin, values below it are counted in the first bin
+        :param maxval: the upper edge of the last bin, values above it are counted in the last bin
+        :return: (counts,edges) where counts has TermPlotter.histogram_bins values and edges has one more
+        """
+        arr = np.asarray(arr)
+        # bin edges are computed in the type of the values, float32 edges cannot divide narrow ranges
+        values = np.clip(arr[~np.isnan(arr)].astype(np.float64), minval, maxval)
+        return np.histogram(values, bins=TermPlotter.histogram_bins, range=(minval, maxval))
+
+    @staticmethod
+    def getPercentile(arr,percentile,rounds=3):
+        """
+        estimate a percentile of the non-NaN values of an array from fixed width histograms, without sorting.
+        Each round counts only the values in the bin of the previous round that the percentile falls in, so that
+        the estimate stays accurate when a few outliers stretch the range of the values.
+        :param arr: a numpy array
+        :param percentile: the percentile, in the range 0 to 100
+        :param rounds: the maximum number of histograms to count
+        :return: the estimated value, interpolated within the bin of the last round
+        """
+        values = np.asarray(arr)
+        values = values[~np.isnan(values)].astype(np.float64)
+        target = len(values) * percentile / 100
+        (low, high) = (values.min(), values.max())
+        (count, below) = (len(values), 0) # the number of values in the range low to high, and below low
+        for _ in range(rounds):
+            if high - low <= TermPlotter.histogram_bins * np.spacing(max(abs(low), abs(high))):
+                # the range is too narrow to divide into bins
+                break
+            (counts, edges) = np.histogram(values, bins=TermPlotter.histogram_bins, range=(low, high))
+            cumulative = below + np.cumsum(counts)
+            index = min(int(np.searchsorted(cumulative, target)), len(counts) - 1)
+            (count, below) = (counts[index], cumulative[index] - counts[index])
+            (low, high) = (edges[index], edges[index + 1])
+            if count <= 1:
+                break
+            # the last bin includes its upper edge
+            values = values[(values >= low) & ((values < high) if index < len(counts) - 1 else (values <= high))]
+        fraction = (target - below) / count if count else 0
+        return low + fraction * (high - low)
+
+    def selectvar(self,ds,var_name,indices=None,stride_y=1,stride_x=1):
+        """
+        select the 2D slice of a variable to plot, without reading it
+        :param ds: the xarray dataset
+        :param var_name: the name of a variable in the dataset
+        :param indices: dictionary mapping from dimension names to the index to plot, overriding the plotter's indices
+        :param stride_y: read only every Nth value along the y dimension
+        :param stride_x: read only every Nth value along the x dimension
+        :return: (arr,fixed_indices) where arr is a lazily loaded 2D xarray DataArray with the x and y dimensions
+                 and fixed_indices maps from the names of the other dimensions to the index used
+        """
+        selected = self.getIndices(indices)
+        variable = ds[var_name]
+        dims = variable.dims
+        # indices may be given for dimensions of other variables in the dataset, but not for unknown dimensions
+        for dimension in selected:
+            if dimension not in dims and dimension not in ds.sizes:
+                print("dimension %s not in variable %s, which has dimensions %s" % (dimension, var_name, ",".join(dims)))
+                sys.exit(-1)
+
+        # extract a 2D dataset, setting other indices to 0 unless selected
         lookup = []
+        fixed_indices = {}
         for index in range(len(dims)):
-            if index != x_index and index != y_index:
+            if dims[index] == self.x_dimension:
+                lookup.append(slice(0, variable.shape[index], stride_x))
+            elif dims[index] == self.y_dimension:
+                lookup.append(slice(0, variable.shape[index], stride_y))
+            else:
                 # for dimensions other than x, and y, use a fixed index
-                lookup.append(0)
-            elif index == x_index:
-                lookup.append(slice(0, original_width))
-            elif index == y_index:
-                lookup.append(slice(0, original_height))
-        arr = variable[tuple(lookup)]
-
-        # get NaN statistics before coarsening
-        nan_fraction = np.count_nonzero(np.isnan(arr.data)) / (original_width * original_height)
-
-        # work out the size of the window to coarsen the array
-        window_size_x = math.ceil(ds.sizes[self.x_dimension] / self.plot_width)
-        window_size_y = math.ceil(ds.sizes[self.y_dimension] / self.plot_height)
-
-        # if the window size in either dimension is > 1, coarsen the data
-        if window_size_x > 1 or window_size_y > 1:
-            arr = arr.coarsen({self.y_dimension: window_size_y, self.x_dimension: window_size_x}, boundary="pad")\
-                .mean(skipna=True).data
-
-        # work out max and min values if not specified explicitly
-        maxval = self.max_value if self.max_value is not None else np.nanmax(arr)
-        minval = self.min_value if self.min_value is not None else np.nanmin(arr)
-
-        # normalise the array so that values lie in the range 0.0 to 1.0
-        if minval is None or maxval is None:
-            # corner case: no values in the data
-            pass
-        elif minval == maxval:
-            # edge case: only one value in the data
-            data = np.where(np.isnan(arr), arr, 0.5)
-        else:
-            data = (arr - minval) / (maxval - minval)
+                fixed_index = selected.get(dims[index], 0)
+                if fixed_index < 0:
+                    # negative indices count back from the end of the dimension
+                    fixed_index += variable.shape[index]
+                if not 0 <= fixed_index < variable.shape[index]:
+                    print("index %d out of range for dimension %s of size %d"
+                          % (selected.get(dims[index], 0), dims[index], variable.shape[index]))
+                    sys.exit(-1)
+                lookup.append(fixed_index)
+                fixed_indices[dims[index]] = fixed_index
+        return (variable[tuple(lookup)], fixed_indices)
+
+    def loadOverview(self,ds,var_name,fixed_indices,arr,downsampler):
+        """
+        coarsen a 2D array using an overview from the cache, building and storing the overview if it is not cached
+        :param ds: the xarray dataset
+        :param var_name: the name of a variable in the dataset
+        :param fixed_indices: dictionary mapping from the names of the other dimensions to the index used
+        :param arr: a lazily loaded 2D xarray DataArray with the x and y dimensions
+        :param downsampler: a Downsampler holding the coarsening windows, for the mean reduction
+        :return: (nan_count,coarsened) with coarsened in the same dimension order as arr, or (None,None)
+        """
+        path = ds.encoding.get("source")
+        if path is None:
+            # the dataset was not loaded from a file
+            return (None, None)
+        backend = ds.encoding.get("backend", "auto")
+        layout = ds.encoding.get("layout")
+        dims = (self.y_dimension, self.x_dimension)
 
-        # make sure that array is organised by [y,x]
-        if y_index > x_index:
-            data = np.transpose(data)
+        with self.profile("cache_load", var_name):
+            overview = self.cache.load(path, var_name, dims, fixed_indices, backend, layout)
+        if overview is None:
+            # read the array in blocks within max_memory, as in coarsenBlocks
+            max_memory = self.max_memory
+            if max_memory is None and getattr(arr, "streamed", False):
+                max_memory = TermPlotter.block_memory
 
-        # invert the array if flip specified
-        if self.flip:
-            data = np.flipud(data)
+            def read(start,stop):
+                block = arr.isel({self.y_dimension: slice(start, stop)})
+                return block.transpose(self.y_dimension, self.x_dimension).values
 
-        return (nan_fraction,minval,maxval,data,original_height,original_width)
+            with self.profile("read+cache_store", var_name) as record:
+                overview = self.cache.store(path, var_name, dims, fixed_indices, read,
+                                            (arr.sizes[self.y_dimension], arr.sizes[self.x_dimension]), arr.dtype,
+                                            backend, layout, max_memory)
+                record["bytes"] = arr.nbytes
+
+        with self.profile("coarsen", var_name) as record:
+            coarsened = overview.coarsen(downsampler.edges_y, downsampler.edges_x)
+            if coarsened is not None:
+                record["shape"] = "%s->%s" % (tuple(overview.metadata["shape"]), coarsened.shape)
+        if coarsened is None:
+            return (None, None)
+        if arr.dims.index(self.y_dimension) > arr.dims.index(self.x_dimension):
+            coarsened = np.transpose(coarsened)
+        return (overview.nan_count, coarsened)
+
+    def coarsenBlocks(self,arr,downsampler):
+        """
+        read and coarsen a 2D array in blocks of rows, using a pool of threads.
+        The blocks are sized so that the blocks being processed at any one time fit within max_memory, and are
+        aligned to the chunks the variable is stored in (if any) so that each chunk is read only once.  Windows
+        that span two blocks are combined from the partial results for each block.
+        :param arr: a lazily loaded 2D xarray DataArray with the x and y dimensions
+        :param downsampler: a Downsampler holding the coarsening windows and the reduction
+        :return: (nan_count,coarsened) where coarsened is a numpy array with the same dimension order as arr
+        """
+        height = arr.sizes[self.y_dimension]
+        width = arr.sizes[self.x_dimension]
+        workers = self.workers if self.workers else (os.cpu_count() or 1)
+        max_memory = self.max_memory
+        if max_memory is None and getattr(arr, "streamed", False):
+            max_memory = TermPlotter.block_memory
+
+        # allow for the block being read, a sorted copy (for the mode reduction) and masks of its NaN values
+        bytes_per_row = width * (2 * arr.dtype.itemsize + 2)
+        # align blocks to whole chunks.  If a block of whole chunks for each worker would not fit within max_memory,
+        # read smaller blocks, reading each chunk more than once, unless the chunks are compressed as every read of
+        # part of a compressed chunk decompresses all of it
+        chunks = arr.chunks if isinstance(arr, NetCDFArray) else None
+        alignment = chunks[arr.dims.index(self.y_dimension)] if chunks else 1
+        if max_memory is not None and workers * bytes_per_row * alignment > max_memory:
+            if not arr.compressed:
+                alignment = 1
+            elif self.max_memory is not None:
+                sys.stderr.write("WARNING: unable to read and coarsen within %d bytes, the variable is stored in "
+                                 "compressed chunks of %d rows, using up to %d bytes\n"
+                                 % (max_memory, alignment, workers * bytes_per_row * alignment))
+        # by default give each worker one block, use smaller blocks if needed to stay within max_memory
+        alignment_count = math.ceil(math.ceil(height / alignment) / workers)
+        if max_memory is not None:
+            alignment_count = min(alignment_count, max_memory // (workers * bytes_per_row * alignment))
+        block_height = max(1, alignment_count) * alignment
+
+        def reduceBlock(start):
+            block = arr.isel({self.y_dimension: slice(start, start + block_height)})
+            block = block.transpose(self.y_dimension, self.x_dimension).values
+            return downsampler.reduce(block, start)
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(reduceBlock, range(0, height, block_height)))
+        (nan_count, coarsened) = downsampler.combine(results)
+
+        # return the array organised in the same dimension order as the input
+        if arr.dims.index(self.y_dimension) > arr.dims.index(self.x_dimension):
+            coarsened = np.transpose(coarsened)
+        return (nan_count, coarsened)
+
+    def estimateRange(self,ds,var_name,dimension,sample_count=8):
+        """
+        estimate the range of values of a variable across a dimension, reading a strided sample from a few of its
+        indices, so that a fixed colour scale can be used for every index
+        :param ds: the xarray dataset
+        :param var_name: the name of a variable in the dataset
+        :param dimension: the name of the dimension
+        :param sample_count: the maximum number of indices to sample
+        :return: (minval,maxval), which are NaN if no values are found
+        """
+        variable = ds[var_name]
+        size = ds.sizes[dimension]
+        original_height = ds.sizes[self.y_dimension]
+        original_width = ds.sizes[self.x_dimension]
+
+        # read about one value per plotted cell from each sampled index
+        stride_y = max(1, math.ceil(original_height / (self.plot_height * self.cell_rows)))
+        stride_x = max(1, math.ceil(original_width / self.plot_width))
+        selection = {dim: index for (dim, index) in self.indices.items() if dim in variable.dims}
+        selection.update({self.y_dimension: slice(0, original_height, stride_y),
+                          self.x_dimension: slice(0, original_width, stride_x)})
+        minval = np.nan
+        maxval = np.nan
+        for index in np.unique(np.linspace(0, size - 1, min(size, sample_count)).astype(int)):
+            selection[dimension] = int(index)
+            sample = variable.isel(selection).values
+            if np.any(~np.isnan(sample)):
+                minval = np.nanmin([minval, np.nanmin(sample)])
+                maxval = np.nanmax([maxval, np.nanmax(sample)])
+        return (minval, maxval)
+
+    def getSampleStrides(self,original_height,original_width):
+        """
+        work out the strides used to sample a variable along the y and x dimensions
+        :param original_height: the size of the variable along the y dimension
+        :param original_width: the size of the variable along the x dimension
+        :return: (stride_y,stride_x), both 1 if all values are read
+        """
+        if self.sample_stride:
+            return (self.sample_stride, self.sample_stride)
+        if self.fast:
+            # read about one value per plotted cell, and at least one for each cell so that the plot is filled
+            return (max(1, original_height // (self.plot_height * self.cell_rows)),
+                    max(1, original_width // self.plot_width))
+        return (1, 1)
 
     def getColourCode(self,index):
         """
@@ -361,17 +1117,54 @@ class TermPlotter:
             index = 0
         elif index >= len(self.colour_scale):
             index = len(self.colour_scale) - 1
+        if self.encoding == "text":
+            return index
         r, g, b = self.colour_scale[index]
-        return self.getClosestColourCode(int(255 * r), int(255 * g), int(255 * b))
+        return self.getRGBColourCode(int(255 * r), int(255 * g), int(255 * b))
+
+    def getRGBColourCode(self,r,g,b):
+        """
+        gets the colour code used to display given r,g,b values
+        :param r: red value in the range 0 to 255
+        :param g: green value in the range 0 to 255
+        :param b: blue value in the range 0 to 255
+        :return: the packed 24-bit colour in truecolour mode, otherwise the closest ansi colour code
+        """
+        if self.truecolour:
+            return (r << 16) | (g << 8) | b
+        return self.getClosestColourCode(r,g,b)
+
+    def getRGBColourCodes(self,rgb):
+        """
+        gets the colour codes used to display an array of r,g,b values
+        :param rgb: an integer array with shape (...,3) holding red, green and blue values in the range 0 to 255
+        :return: an integer array with shape (...) holding the colour codes, see getRGBColourCode
+        """
+        rgb = np.asarray(rgb, dtype=np.int32)
+        if self.encoding == "text":
+            # index the colour scale by luminance
+            luminance = 0.299 * rgb[...,0] + 0.587 * rgb[...,1] + 0.114 * rgb[...,2]
+            return np.minimum((luminance * TermPlotter.colour_count / 256).astype(np.int32), TermPlotter.colour_count - 1)
+        if self.truecolour:
+            return (rgb[...,0] << 16) | (rgb[...,1] << 8) | rgb[...,2]
+        return TermPlotter.getClosestColourCodes(rgb)
 
     def getColourBGString(self,ansi_colour_code,s=" ",reset=False):
         """
         gets a background coloured string
-        :param ansi_colour_code: the ansi colour code, in the range 0 to 255
+        :param ansi_colour_code: the ansi colour code, in the range 0 to 255, or a packed 24-bit colour in truecolour mode
         :param s: the string to print
         :param reset: whether to reset the colours at the end of the string
         :return: a string which prints the coloured string, using the closest available colour in the ANSI palette
         """
+        if self.encoding == "text":
+            # the character for a colour scale index, or a space if missing
+            if ansi_colour_code < 0:
+                return " "
+            return TermPlotter.text_ramp[ansi_colour_code * len(TermPlotter.text_ramp) // TermPlotter.colour_count]
+        if self.truecolour:
+            return "\u001b[48;2;%d;%d;%dm" % ((ansi_colour_code >> 16) & 255, (ansi_colour_code >> 8) & 255,
+                                              ansi_colour_code & 255) + s + (TermPlotter.reset_escape_code if reset else "")
         return "\u001b[48;5;" + str(ansi_colour_code) + "m"+s + (TermPlotter.reset_escape_code if reset else "")
 
     def getClosestColourCode(self, r, g, b):
@@ -383,27 +1176,70 @@ class TermPlotter:
         :return: the ansi colour code that most closely matches the (r,g,b) values
         """
         # to avoid lengthy repeated searches, check if the value has already been computed and cached
+        if self.profiler is not None:
+            self.profiler.countColourLookup((r, g, b) in self.cached_colours)
         if (r, g, b) in self.cached_colours:
             return self.cached_colours[(r, g, b)]
 
         # search through the ansi colours to find the most similar one
-        closest_sqdistance = None
-        closest_index = None
-        for col_index in range(len(TermPlotter.ansi_colours)):
-            (lr, lg, lb) = TermPlotter.ansi_colours[col_index]
-            sqdistance = (lr - r) ** 2 + (lg - g) ** 2 + (lb - b) ** 2
-            if closest_sqdistance is None or sqdistance < closest_sqdistance:
-                closest_sqdistance = sqdistance
-                closest_index = col_index
+        closest_index = int(TermPlotter.getClosestColourCodes(np.array([r, g, b]))[()])
 
         # update the cache to avoid recomputation of the same value
         self.cached_colours[(r,g,b)] = closest_index
         return closest_index
 
-    def clearTerminal(self):
+    @staticmethod
+    def getClosestColourCodes(rgb):
+        """
+        gets the ansi colour codes that most closely match an array of r,g,b values
+        :param rgb: an integer array with shape (...,3) holding red, green and blue values in the range 0 to 255
+        :return: an integer array with shape (...) holding the closest ansi colour code to each (r,g,b) value
+        """
+        rgb = np.asarray(rgb, dtype=np.int64)
+        shape = rgb.shape[:-1]
+
+        # search only once for each distinct colour
+        packed = ((rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]).ravel()
+        (unique_packed, inverse) = np.unique(packed, return_inverse=True)
+        unique_rgb = np.stack([unique_packed >> 16, (unique_packed >> 8) & 255, unique_packed & 255], axis=-1)
+
+        # |p-c|^2 = |p|^2 - 2p.c + |c|^2, and |c|^2 does not affect which palette colour p is closest.
+        # the values are small integers so the distances are exact in floating point
+        palette = TermPlotter.ansi_palette.astype(np.float64)
+        palette_sqnorms = (palette ** 2).sum(axis=1)
+        codes = np.empty(len(unique_rgb), dtype=np.intp)
+        block_size = 4096
+        for start in range(0, len(unique_rgb), block_size):
+            block = unique_rgb[start:start+block_size].astype(np.float64)
+            sqdistances = palette_sqnorms[None, :] - 2 * (block @ palette.T)
+            codes[start:start+block_size] = np.argmin(sqdistances, axis=1)
+        return codes[inverse.ravel()].reshape(shape)
+
+    @staticmethod
+    def clearTerminal():
         os.system('cls' if os.name == 'nt' else 'clear')
 
-    def getKeyPress(self,prompt):
+    def readKey(self):
+        """
+        wait for a key press, with the terminal already in non-canonical mode
+        :return: the key pressed, with the arrow keys returned as "up", "down", "left" and "right"
+        """
+        if os.name == 'nt':
+            import msvcrt
+            c = msvcrt.getwch()
+            if c in ("\x00", "\xe0"):
+                return {"H": "up", "P": "down", "K": "left", "M": "right"}.get(msvcrt.getwch(), "")
+            return c
+        c = sys.stdin.read(1)
+        if c == "\u001b":
+            # arrow keys send an escape sequence such as ESC [ A
+            if sys.stdin.read(1) in ("[", "O"):
+                return {"A": "up", "B": "down", "C": "right", "D": "left"}.get(sys.stdin.read(1), "")
+            return ""
+        return c
+
+    @staticmethod
+    def getKeyPress(prompt):
         sys.stdout.write(prompt)
         sys.stdout.flush()
         if os.name == 'nt':
@@ -425,70 +1261,2511 @@ class TermPlotter:
                 termios.tcsetattr(fd, termios.TCSAFLUSH, oldterm)
 
 
-if __name__ == '__main__':
+class PlotPager:
+    """
+    Renders the pages of a TermPlotter lazily.  While one page is displayed, the next pages are loaded and
+    rendered by a background thread.  Recently rendered pages are kept so that paging back is instant.
+    """
 
-    import argparse
-    parser = argparse.ArgumentParser(
-        description="Utility for plotting 2d data from netcdf4 file to a 256-colour terminal window. "+
-                    "Requires xarray+netcdf4.")
-    parser.add_argument("input_path", help="path to a netcdf4 file")
-    parser.add_argument("-x", "--x-dimension", dest="x", metavar="<dimension>",
-                help="the dimension to plot on the x-axis",default="")
-    parser.add_argument("-y", "--y-dimension", dest="y", metavar="<dimension>",
-                help="the dimension to plot on the y-axis",default="")
-    parser.add_argument("-v", "--variable", dest="variables",
-                help="the variable name(s) to plot", nargs="+", metavar="<variable>", default=[])
-    parser.add_argument("--colour-map",
-                help="choose the colour map as a comma separated list of colours", default="blue,green,red")
-    parser.add_argument("--missing-colour",
-                help="set the name of a colour to represent NaN values", default="black")
-    parser.add_argument("--plot-width",
-                help="set width of the plot in characters, by default uses the entire terminal width",type=int)
-    parser.add_argument("--plot-height",
-                help="set height of the plot in characters, by default uses the entire terminal height",type=int)
-    parser.add_argument("--min-value",
-                help="set minimum value on the colour scale",type=float)
-    parser.add_argument("--max-value",
-                help="set the maximum value on the colour scale",type=float)
-    parser.add_argument("--flip",action="store_true",
-                help="specify that the first rows in the image should appear at the top of the plot, not the bottom")
-    parser.add_argument("--nocheck", action="store_true",
-                help="ignore result of checking if the terminal supports 256 colours")
+    def __init__(self,plotter,pages,prefetch=2,cache_size=8):
+        """
+        Create a PlotPager.
 
+        :param plotter: the TermPlotter used to render pages
+        :param pages: the pages to render, from TermPlotter.getPages
+        :param prefetch: the number of pages after the current page to render in the background
+        :param cache_size: the number of rendered pages to keep
+        """
+        from collections import OrderedDict
+        from concurrent.futures import ThreadPoolExecutor
+        self.plotter = plotter
+        self.pages = pages
+        self.prefetch = prefetch
+        self.cache_size = cache_size
+        self.rendered = OrderedDict() # mapping from page index to rendered page, least recently used first
+        self.pending = {} # mapping from page index to the future rendering the page
+        self.executor = ThreadPoolExecutor(max_workers=1)
 
-    args = parser.parse_args()
+    def __len__(self):
+        return len(self.pages)
 
-    if os.getenv("TERM") != "xterm-256color":
-        print(("WARNING: " if args.nocheck else "ERROR: ") + "terminal does not appear to support 256 colours.")
-        if not args.nocheck:
-            sys.exit(-1)
+    def get(self,index):
+        """
+        get a rendered page, waiting for it to be rendered if necessary
+        :param index: the index of the page
+        :return: the contents of the plot
+        """
+        if index in self.rendered:
+            self.rendered.move_to_end(index)
+            self.schedule(index)
+            return self.rendered[index]
 
-    ds = xr.open_dataset(args.input_path)
+        self.schedule(index)
+        plot = self.pending.pop(index).result()
+        self.rendered[index] = plot
+        if len(self.rendered) > self.cache_size:
+            self.rendered.popitem(last=False)
+        return plot
 
-    tp = TermPlotter(ds,args.colour_map,args.missing_colour,
-                     args.x,args.y,
-                     args.plot_width,args.plot_height,
-                     args.min_value,args.max_value,
-                     not args.flip)
+    def schedule(self,index):
+        """
+        queue a page and the pages following it for rendering, cancelling any queued pages no longer needed
+        :param index: the index of the page to be displayed
+        """
+        wanted = range(index, min(index + self.prefetch + 1, len(self.pages)))
+        for (pending_index, future) in list(self.pending.items()):
+            if pending_index not in wanted and future.cancel():
+                del self.pending[pending_index]
+        for page_index in wanted:
+            if page_index not in self.rendered and page_index not in self.pending:
+                self.pending[page_index] = self.executor.submit(self.plotter.plotPage, self.pages[page_index])
 
-    plots = tp.plot(args.variables)
+    def close(self):
+        """
+        stop rendering pages in the background
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
-    if len(plots) == 0:
-        print("No variables found to plot")
 
-    # print the first plot
-    if len(plots) >= 1:
-        tp.clearTerminal()
-        print(plots[0])
+class PlotAnimator:
+    """
+    Plays a variable as an animation along one of its dimensions.  A background thread loads and renders frames
+    ahead of the display into a bounded queue.  Counts of dropped and stalled frames, and the time taken to load and
+    display each frame, show whether reading the data or displaying it limits the frame rate.
+    """
 
-    # print any remaining plots, waiting for key presses
-    for x in range(1,len(plots)):
-        c = tp.getKeyPress("Press Any Key (q to quit)>")
-        if c == 'q' or c == 'Q':
-            print("")
-            sys.exit(0)
-        tp.clearTerminal()
-        print(plots[x])
+    def __init__(self,plotter,var_name,dimension,fps=5,queue_size=4):
+        """
+        Create a PlotAnimator.
+
+        :param plotter: the TermPlotter used to render frames
+        :param var_name: the name of the variable to animate
+        :param dimension: the name of the dimension to animate along
+        :param fps: the target number of frames per second
+        :param queue_size: the maximum number of frames rendered ahead of the display
+        """
+        import queue
+        self.plotter = plotter
+        self.var_name = var_name
+        self.dimension = dimension
+        self.fps = fps
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.frame_count = plotter.ds.sizes[dimension]
+        self.stopped = False
+        self.latest = -1 # the index of the latest frame rendered
+        self.shown = 0
+        self.dropped = 0 # frames skipped because the display fell behind
+        self.stalled = 0 # frames shown late because they were not rendered in time
+        self.load_times = []
+        self.display_times = []
+
+    def produce(self):
+        """
+        load and render each frame in turn, queueing them for display
+        """
+        import time
+        for index in range(self.frame_count):
+            if self.stopped:
+                break
+            start_time = time.perf_counter()
+            try:
+                plot = self.plotter.plotvar(self.plotter.ds, self.var_name, {self.dimension: index})
+            except Exception as ex:
+                self.frames.put((index, ex))
+                return
+            self.load_times.append(time.perf_counter() - start_time)
+            self.frames.put((index, plot))
+            self.latest = index
+        self.frames.put((None, None))
+
+    def play(self):
+        """
+        play the animation, displaying each frame when it is due
+        """
+        import queue
+        import time
+
+        # use a colour scale covering the whole animation, unless one was given explicitly
+        if self.plotter.min_value is None or self.plotter.max_value is None:
+            (minval, maxval) = self.plotter.estimateRange(self.plotter.ds, self.var_name, self.dimension)
+            if self.plotter.min_value is None and not math.isnan(minval):
+                self.plotter.min_value = minval
+            if self.plotter.max_value is None and not math.isnan(maxval):
+                self.plotter.max_value = maxval
+
+        producer = threading.Thread(target=self.produce, daemon=True)
+        producer.start()
+
+        interval = 1 / self.fps
+        start_time = None # the time at which frame 0 is (or would have been) due
+        next_index = 0
+        self.plotter.clearTerminal()
+        try:
+            while True:
+                # wait for the next frame until it is due, after which the display has stalled
+                try:
+                    if start_time is None:
+                        (index, plot) = self.frames.get()
+                    else:
+                        wait = start_time + next_index * interval - time.perf_counter()
+                        (index, plot) = self.frames.get(timeout=max(0, wait))
+                except queue.Empty:
+                    self.stalled += 1
+                    (index, plot) = self.frames.get()
+                    start_time = None
+                if index is None:
+                    break
+                if isinstance(plot, Exception):
+                    raise plot
+
+                now = time.perf_counter()
+                if start_time is None:
+                    # start, or restart after a stall, the schedule from this frame
+                    start_time = now - index * interval
+                due_time = start_time + index * interval
+                next_index = index + 1
+                if now > due_time + interval and self.latest > index:
+                    # the display is behind, skip to a later frame that is already rendered
+                    self.dropped += 1
+                    continue
+                if now < due_time:
+                    time.sleep(due_time - now)
+
+                display_start = time.perf_counter()
+                # move the cursor to the top left and overwrite the previous frame
+                sys.stdout.write("\u001b[H" + plot + " %s=%d/%d\n" % (self.dimension, index, self.frame_count - 1))
+                sys.stdout.flush()
+                self.display_times.append(time.perf_counter() - display_start)
+                self.shown += 1
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped = True
+
+    def report(self):
+        """
+        summarise the frame counters
+        :return: a printable summary of the frames shown, dropped and stalled, and the load and display times
+        """
+        def times(values):
+            if not values:
+                return "-"
+            return "mean %.1fms max %.1fms" % (1000 * sum(values) / len(values), 1000 * max(values))
+
+        return "frames: %d shown, %d dropped, %d stalled. load+render: %s. display: %s" % (
+            self.shown, self.dropped, self.stalled, times(self.load_times), times(self.display_times))
+
+
+class PlotFollower:
+    """
+    Follows a variable in a file that is still being written, plotting the latest record along a dimension (usually
+    the unlimited dimension).  The file is polled by checking its size and modification time, and reopened only
+    when it changes, so that only newly appended records are read.  The file is closed between polls so that the
+    program writing it is not locked out.  The coarsened records are kept in memory so that earlier records can be
+    shown again without reading them.
+    """
+
+    def __init__(self,plotter,var_name,dimension,path,backend="auto",interval=2,history_size=1000):
+        """
+        Create a PlotFollower.
+
+        :param plotter: the TermPlotter used to read and render records
+        :param var_name: the name of the variable to follow
+        :param dimension: the name of the dimension that records are appended along
+        :param path: the path of the file
+        :param backend: how to reopen the file, see open_dataset
+        :param interval: the time between polls of the file, in seconds
+        :param history_size: the maximum number of coarsened records to keep, the oldest are removed first
+        """
+        from collections import OrderedDict
+        self.plotter = plotter
+        self.var_name = var_name
+        self.dimension = dimension
+        self.path = path
+        self.backend = backend
+        self.interval = interval
+        self.history_size = history_size
+        self.history = OrderedDict() # mapping from record index to the result of TermPlotter.loadvar
+        self.length = 0 # the number of records read
+        self.signature = None # the size and modification time of the file when it was last read
+        self.position = None # the index of the record shown, or None to show the latest record
+
+    def poll(self):
+        """
+        check whether the file has changed, reading any new records
+        :return: true if the file has changed
+        """
+        stat = os.stat(self.path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        if signature == self.signature:
+            return False
+
+        # reopen the file to see the new length of the dimension, the plotter's dataset is used for the first poll
+        ds = self.plotter.ds if self.signature is None else open_dataset(self.path, self.backend)
+        try:
+            length = ds.sizes[self.dimension]
+            if length < self.length:
+                # the file has been rewritten
+                self.history.clear()
+                self.length = 0
+            # the last record read may have been incomplete, so read it again
+            for index in range(max(0, self.length - 1), length):
+                self.history[index] = self.plotter.loadvar(ds, self.var_name, {self.dimension: index})
+                self.history.move_to_end(index)
+                if len(self.history) > self.history_size:
+                    self.history.popitem(last=False)
+        finally:
+            ds.close()
+        # the closed dataset still describes the variable, for labelling plots
+        self.plotter.ds = ds
+        self.signature = signature
+        self.length = length
+        return True
+
+    def step(self,records):
+        """
+        move the record shown, stepping past the latest record follows the latest record again
+        :param records: the number of records to move by, negative to move to earlier records
+        """
+        index = (self.length - 1 if self.position is None else self.position) + records
+        self.position = max(0, index) if index < self.length - 1 else None
+
+    def render(self):
+        """
+        render the record shown
+        :return: the plot of the record, with a status line
+        """
+        if self.length == 0:
+            return "%s has no records along %s, waiting...\n" % (self.var_name, self.dimension)
+        index = self.length - 1 if self.position is None else self.position
+        loaded = self.history.get(index)
+        if loaded is None:
+            # the record is no longer in the history, read it again
+            with open_dataset(self.path, self.backend) as ds:
+                loaded = self.plotter.loadvar(ds, self.var_name, {self.dimension: index})
+        plot = self.plotter.plotvar(self.plotter.ds, self.var_name, {self.dimension: index}, loaded)
+        return plot + "\n%s=%d/%d %s (b/n to step back/forward, f to follow, q to quit)\n" % (
+            self.dimension, index, self.length - 1, "following" if self.position is None else "paused")
+
+    def waitForKey(self,timeout):
+        """
+        wait for a key press, with the terminal already in non-canonical mode
+        :param timeout: the maximum time to wait, in seconds
+        :return: the key pressed (see TermPlotter.readKey), or None if no key was pressed
+        """
+        import time
+        if os.name == 'nt':
+            import msvcrt
+            end_time = time.perf_counter() + timeout
+            while not msvcrt.kbhit():
+                if time.perf_counter() >= end_time:
+                    return None
+                time.sleep(0.05)
+        else:
+            import select
+            if not select.select([sys.stdin], [], [], timeout)[0]:
+                return None
+        return self.plotter.readKey()
+
+    def run(self):
+        """
+        follow the file until q is pressed
+        """
+        import time
+        fd = None
+        if os.name != 'nt':
+            import termios
+            fd = sys.stdin.fileno()
+            oldterm = termios.tcgetattr(fd)
+            newattr = termios.tcgetattr(fd)
+            newattr[3] = newattr[3] & ~termios.ICANON & ~termios.ECHO
+            termios.tcsetattr(fd, termios.TCSANOW, newattr)
+
+        actions = {"b": lambda: self.step(-1), "left": lambda: self.step(-1),
+                   "n": lambda: self.step(1), "right": lambda: self.step(1),
+                   "f": lambda: setattr(self, "position", None)}
+        self.plotter.clearTerminal()
+        try:
+            next_poll = time.perf_counter()
+            redraw = True
+            while True:
+                if time.perf_counter() >= next_poll:
+                    try:
+                        redraw = self.poll() or redraw
+                    except OSError:
+                        # the file may be unreadable while it is being written, try again at the next poll
+                        pass
+                    next_poll = time.perf_counter() + self.interval
+                if redraw:
+                    # move the cursor to the top left, overwrite the previous plot and clear anything below it
+                    sys.stdout.write("\u001b[H" + self.render() + "\u001b[J")
+                    sys.stdout.flush()
+                    redraw = False
+                key = self.waitForKey(max(0, next_poll - time.perf_counter()))
+                if key in ("q", "Q"):
+                    break
+                if key in actions:
+                    actions[key]()
+                    redraw = True
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+            if fd is not None:
+                termios.tcsetattr(fd, termios.TCSAFLUSH, oldterm)
+
+
+class PlotViewer:
+    """
+    An interactive viewer for a variable, supporting zooming and panning.  At each zoom level the variable is
+    divided into tiles of coarsened cells.  Only the tiles in view are read, at the resolution needed, and recently
+    viewed tiles are kept so that panning back is instant.  Redraws only update the cells that have changed.
+    """
+
+    help = "+/- zoom, arrows or h/j/k/l pan, r reset, q quit"
+
+    def __init__(self,plotter,var_name,tile_size=32,cache_size=256):
+        """
+        Create a PlotViewer.
+
+        :param plotter: the TermPlotter used to read and render the variable
+        :param var_name: the name of the variable to view
+        :param tile_size: the width and height of each tile, in coarsened cells
+        :param cache_size: the maximum number of tiles to keep
+        """
+        from collections import OrderedDict
+        self.plotter = plotter
+        self.var_name = var_name
+        self.tile_size = tile_size
+        self.cache_size = cache_size
+        self.tiles = OrderedDict() # mapping from (cells_y,cells_x,tile_row,tile_column) to tile
+        (self.arr, _) = plotter.selectvar(plotter.ds, var_name)
+        self.height = self.arr.sizes[plotter.y_dimension]
+        self.width = self.arr.sizes[plotter.x_dimension]
+        self.minval = None
+        self.maxval = None
+        self.codes = None # the colour codes currently displayed
+        self.reset()
+
+    def reset(self):
+        """
+        zoom out to show the whole variable
+        """
+        self.zoom = 0
+        self.centre_y = self.height / 2
+        self.centre_x = self.width / 2
+
+    def getCellCounts(self):
+        """
+        work out the number of coarsened cells the whole variable is divided into at the current zoom level.  At
+        each level the view fills the plot, dividing the variable with the same windows as Downsampler.getEdges
+        :return: (cells_y,cells_x)
+        """
+        scale = 2 ** self.zoom
+        return (min(self.height, self.plotter.plot_height * self.plotter.cell_rows * scale),
+                min(self.width, self.plotter.plot_width * scale))
+
+    def zoomIn(self):
+        if self.getCellCounts() != (self.height, self.width):
+            self.zoom += 1
+
+    def zoomOut(self):
+        self.zoom = max(0, self.zoom - 1)
+
+    def pan(self,rows,columns):
+        """
+        move the view by a fraction of its size
+        :param rows: the fraction of the view height to move along the y dimension
+        :param columns: the fraction of the view width to move along the x dimension
+        """
+        (cells_y, cells_x) = self.getCellCounts()
+        self.centre_y = min(max(self.centre_y + rows * self.plotter.plot_height * self.plotter.cell_rows
+                                * self.height / cells_y, 0), self.height)
+        self.centre_x = min(max(self.centre_x + columns * self.plotter.plot_width * self.width / cells_x, 0),
+                            self.width)
+
+    def getTile(self,cells_y,cells_x,tile_row,tile_column):
+        """
+        get a tile of coarsened cells, reading it if it is not already cached
+        :param cells_y: the number of cells the y dimension is divided into
+        :param cells_x: the number of cells the x dimension is divided into
+        :param tile_row: the row of the tile
+        :param tile_column: the column of the tile
+        :return: the coarsened tile as a 2D numpy array organised by [y,x]
+        """
+        key = (cells_y, cells_x, tile_row, tile_column)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+
+        # the windows of the cells in the tile
+        edges_y = Downsampler.getEdges(self.height, cells_y)[tile_row * self.tile_size:
+                                                             (tile_row + 1) * self.tile_size + 1]
+        edges_x = Downsampler.getEdges(self.width, cells_x)[tile_column * self.tile_size:
+                                                            (tile_column + 1) * self.tile_size + 1]
+        block = self.arr.isel({self.plotter.y_dimension: slice(edges_y[0], edges_y[-1]),
+                               self.plotter.x_dimension: slice(edges_x[0], edges_x[-1])})
+        block = block.transpose(self.plotter.y_dimension, self.plotter.x_dimension).values
+        downsampler = Downsampler(self.plotter.reduction, edges_y - edges_y[0], edges_x - edges_x[0], block.dtype)
+        (_, tile) = downsampler.downsample(block)
+
+        self.tiles[key] = tile
+        if len(self.tiles) > self.cache_size:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def getView(self):
+        """
+        get the coarsened cells in view
+        :return: (view,top,left,cells_y,cells_x) where view is a 2D numpy array organised by [y,x], (top,left) is
+                 the first cell in view and (cells_y,cells_x) the number of cells the whole variable is divided into
+        """
+        (cells_y, cells_x) = self.getCellCounts()
+        view_height = min(self.plotter.plot_height * self.plotter.cell_rows, cells_y)
+        view_width = min(self.plotter.plot_width, cells_x)
+
+        # the first cell in view, keeping the view within the variable
+        top = min(max(round(self.centre_y * cells_y / self.height - view_height / 2), 0), cells_y - view_height)
+        left = min(max(round(self.centre_x * cells_x / self.width - view_width / 2), 0), cells_x - view_width)
+
+        view = np.empty((view_height, view_width))
+        for tile_row in range(top // self.tile_size, (top + view_height - 1) // self.tile_size + 1):
+            for tile_column in range(left // self.tile_size, (left + view_width - 1) // self.tile_size + 1):
+                tile = self.getTile(cells_y, cells_x, tile_row, tile_column)
+                # copy the part of the tile that is in view
+                y0 = max(top, tile_row * self.tile_size)
+                y1 = min(top + view_height, tile_row * self.tile_size + tile.shape[0])
+                x0 = max(left, tile_column * self.tile_size)
+                x1 = min(left + view_width, tile_column * self.tile_size + tile.shape[1])
+                view[y0 - top:y1 - top, x0 - left:x1 - left] = \
+                    tile[y0 - tile_row * self.tile_size:y1 - tile_row * self.tile_size,
+                         x0 - tile_column * self.tile_size:x1 - tile_column * self.tile_size]
+        return (view, top, left, cells_y, cells_x)
+
+    def render(self):
+        """
+        render the current view using the plotter's encoding, updating only the cells that differ from the
+        previous render
+        :return: a string containing the escape codes to update the terminal
+        """
+        (view, top, left, cells_y, cells_x) = self.getView()
+
+        # keep the colour scale fixed while zooming and panning, using the range of the whole variable
+        if self.minval is None:
+            self.minval = self.plotter.min_value if self.plotter.min_value is not None else np.nanmin(view)
+            self.maxval = self.plotter.max_value if self.plotter.max_value is not None else np.nanmax(view)
+        if self.minval == self.maxval:
+            data = np.where(np.isnan(view), view, 0.5)
+        else:
+            data = (view - self.minval) / (self.maxval - self.minval)
+        if self.plotter.flip:
+            data = np.flipud(data)
+        codes = self.plotter.getCodes(data)
+
+        # with half block characters, each row of text displays cell_rows rows of cells
+        cell_rows = self.plotter.cell_rows
+        if self.codes is None or self.codes.shape != codes.shape:
+            # clear the screen and draw every cell
+            s = "\u001b[H\u001b[2J" + self.plotter.renderCodes(codes)
+        else:
+            s = ""
+            # work out which cells of each row of text have changed
+            differs = codes != self.codes
+            if len(differs) % cell_rows:
+                differs = np.concatenate([differs, np.zeros((cell_rows - len(differs) % cell_rows, differs.shape[1]),
+                                                            dtype=bool)])
+            differs = np.any(differs.reshape(-1, cell_rows, differs.shape[1]), axis=1)
+            for y in np.flatnonzero(np.any(differs, axis=1)):
+                changed = np.flatnonzero(differs[y])
+                # group the changed cells in this row into spans of adjacent cells
+                span_starts = np.concatenate([[0], np.flatnonzero(np.diff(changed) > 1) + 1])
+                span_ends = np.concatenate([span_starts[1:], [len(changed)]])
+                for (start, end) in zip(span_starts, span_ends):
+                    (x0, x1) = (changed[start], changed[end - 1] + 1)
+                    # position the cursor at the start of the span (rows and columns count from 1)
+                    s += "\u001b[%d;%dH" % (y + 1, x0 + 1)
+                    s += self.plotter.renderCodes(codes[y * cell_rows:(y + 1) * cell_rows, x0:x1]).rstrip("\n")
+        self.codes = codes
+
+        (view_height, view_width) = view.shape
+        edges_y = Downsampler.getEdges(self.height, cells_y)
+        edges_x = Downsampler.getEdges(self.width, cells_x)
+        s += "\u001b[%d;1H\u001b[K%s zoom:%dx x:[%d,%d) y:[%d,%d) [%f %f] %s" % (
+            math.ceil(view_height / cell_rows) + 1, self.var_name, 2 ** self.zoom,
+            edges_x[left], edges_x[left + view_width], edges_y[top], edges_y[top + view_height],
+            self.minval, self.maxval, PlotViewer.help)
+        return s
+
+    def run(self):
+        """
+        run the viewer until q is pressed
+        """
+        fd = None
+        if os.name != 'nt':
+            import termios
+            fd = sys.stdin.fileno()
+            oldterm = termios.tcgetattr(fd)
+            newattr = termios.tcgetattr(fd)
+            newattr[3] = newattr[3] & ~termios.ICANON & ~termios.ECHO
+            termios.tcsetattr(fd, termios.TCSANOW, newattr)
+
+        # moving up shows rows displayed above the current view
+        up = 1 if self.plotter.flip else -1
+        actions = {"+": self.zoomIn, "=": self.zoomIn, "-": self.zoomOut, "r": self.reset,
+                   "up": lambda: self.pan(up / 4, 0), "k": lambda: self.pan(up / 4, 0),
+                   "down": lambda: self.pan(-up / 4, 0), "j": lambda: self.pan(-up / 4, 0),
+                   "left": lambda: self.pan(0, -1 / 4), "h": lambda: self.pan(0, -1 / 4),
+                   "right": lambda: self.pan(0, 1 / 4), "l": lambda: self.pan(0, 1 / 4)}
+        # hide the cursor while viewing
+        sys.stdout.write("\u001b[?25l")
+        try:
+            while True:
+                sys.stdout.write(self.render())
+                sys.stdout.flush()
+                key = self.plotter.readKey()
+                if key in ("q", "Q"):
+                    break
+                if key in actions:
+                    actions[key]()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sys.stdout.write("\u001b[?25h\n")
+            sys.stdout.flush()
+            if fd is not None:
+                termios.tcsetattr(fd, termios.TCSAFLUSH, oldterm)
+
+
+class Downsampler:
+    """
+    Reduce 2D arrays to a given number of cells with vectorised numpy kernels.  Each cell covers a window of whole
+    rows and columns, and when the size of the array is not a multiple of the number of cells the windows differ in
+    size by one row or column, so that the cells exactly fill the plot.  Arrays can be reduced in blocks of rows,
+    the partial results for windows spanning more than one block are combined.
+    """
+
+    # the mean, maximum or minimum of the non-NaN values in each window, the value nearest the centre of each
+    # window, or the most common non-NaN value in each window (for categorical data such as land/sea masks)
+    reductions = ["mean", "max", "min", "nearest", "mode"]
+
+    # the mode reduction counts each distinct value separately, so is limited to categorical data
+    max_categories = 256
+
+    def __init__(self,reduction,edges_y,edges_x,dtype=np.float64):
+        """
+        Create a Downsampler.
+
+        :param reduction: how the values in each window are reduced, one of Downsampler.reductions
+        :param edges_y: the first row of each window along the y dimension, followed by the number of rows
+        :param edges_x: the first column of each window along the x dimension, followed by the number of columns
+        :param dtype: the data type of the arrays, the reduced arrays have the same floating point type (or float64)
+        """
+        self.reduction = reduction
+        self.edges_y = np.asarray(edges_y)
+        self.edges_x = np.asarray(edges_x)
+        self.shape = (len(self.edges_y) - 1, len(self.edges_x) - 1)
+        self.dtype = np.dtype(dtype) if np.dtype(dtype).kind == "f" else np.dtype(np.float64)
+
+    @staticmethod
+    def getEdges(size,cells):
+        """
+        divide a dimension into windows that fill a number of cells, arrays are not enlarged to fill more cells
+        :param size: the size of the dimension
+        :param cells: the number of cells to fill
+        :return: the first index of each window, followed by size
+        """
+        cells = max(1, min(size, cells))
+        return np.arange(cells + 1) * size // cells
+
+    def downsample(self,block):
+        """
+        reduce a whole 2D array
+        :param block: a 2D numpy array organised by [y,x]
+        :return: (nan_count,reduced) where nan_count is the number of NaN values in the array
+        """
+        return self.combine([self.reduce(block)])
+
+    def reduce(self,block,start=0):
+        """
+        reduce a block of rows of a 2D array, giving partial results for the windows that overlap the block
+        :param block: a 2D numpy array organised by [y,x], holding every column
+        :param start: the index of the first row of the block in the array
+        :return: (nan_count,first,partial) where first is the index of the first window overlapping the block and
+                 partial is passed to combine
+        """
+        missing = np.isnan(block) if block.dtype.kind == "f" else None
+        nan_count = np.count_nonzero(missing) if missing is not None else 0
+        if not nan_count:
+            missing = None
+
+        # work out the rows of the block in each window that overlaps it
+        stop = start + block.shape[0]
+        first = np.searchsorted(self.edges_y, start, side="right") - 1
+        end = np.searchsorted(self.edges_y, stop, side="left")
+        starts = np.maximum(self.edges_y[first:end] - start, 0)
+        sizes = np.minimum(self.edges_y[first + 1:end + 1], stop) - start - starts
+        columns = self.edges_x[:-1]
+
+        if self.reduction == "mean":
+            sums = np.add.reduceat(Downsampler.reduceRows(np.add, block, starts, sizes, 0, np.float64, missing),
+                                   columns, axis=1)
+            counts = np.outer(sizes, np.diff(self.edges_x))
+            if missing is not None:
+                counts -= np.add.reduceat(Downsampler.reduceRows(np.add, missing, starts, sizes, 0, np.int32),
+                                          columns, axis=1, dtype=np.int64)
+            partial = (sums, counts)
+        elif self.reduction in ("max", "min"):
+            ufunc = np.fmax if self.reduction == "max" else np.fmin
+            partial = ufunc.reduceat(Downsampler.reduceRows(ufunc, block, starts, sizes, np.nan, self.dtype),
+                                     columns, axis=1)
+        elif self.reduction == "nearest":
+            # the central row of each window, if it is in this block, and the central column
+            centres_y = self.edges_y[first:end] + np.diff(self.edges_y[first:end + 1]) // 2 - start
+            centres_x = columns + np.diff(self.edges_x) // 2
+            partial = np.full((end - first, len(columns)), np.nan, dtype=self.dtype)
+            inside = (centres_y >= 0) & (centres_y < block.shape[0])
+            partial[inside] = block[centres_y[inside]][:, centres_x]
+        elif self.reduction == "mode":
+            categories = np.unique(block)
+            if missing is not None:
+                categories = categories[~np.isnan(categories)]
+            if len(categories) > Downsampler.max_categories:
+                print("The mode reduction is for categorical data, found more than %d distinct values"
+                      % Downsampler.max_categories)
+                sys.exit(-1)
+            # count the values of each category in each window
+            counts = np.zeros((end - first, len(columns), len(categories)), dtype=np.int64)
+            for (index, category) in enumerate(categories):
+                counts[:, :, index] = np.add.reduceat(
+                    Downsampler.reduceRows(np.add, block == category, starts, sizes, 0, np.int32),
+                    columns, axis=1, dtype=np.int64)
+            partial = (categories, counts)
+        else:
+            raise ValueError("unknown reduction %s" % self.reduction)
+        return (nan_count, first, partial)
+
+    def combine(self,results):
+        """
+        combine the partial results of reducing the blocks of an array
+        :param results: a list of (nan_count,first,partial) tuples from reduce
+        :return: (nan_count,reduced) where reduced is a numpy array organised by [y,x]
+        """
+        nan_count = sum(nan_count for (nan_count, first, partial) in results)
+        if self.reduction == "mean":
+            sums = np.zeros(self.shape)
+            counts = np.zeros(self.shape, dtype=np.int64)
+            for (_, first, (block_sums, block_counts)) in results:
+                sums[first:first + len(block_sums)] += block_sums
+                counts[first:first + len(block_counts)] += block_counts
+            with np.errstate(invalid="ignore", divide="ignore"):
+                reduced = np.where(counts > 0, sums / counts, np.nan)
+        elif self.reduction == "mode":
+            categories = np.unique(np.concatenate([partial[0] for (_, first, partial) in results]))
+            counts = np.zeros(self.shape + (len(categories),), dtype=np.int64)
+            for (_, first, (block_categories, block_counts)) in results:
+                indices = np.searchsorted(categories, block_categories)
+                counts[first:first + len(block_counts), :, indices] += block_counts
+            # ties are resolved in favour of the smallest value
+            reduced = np.full(self.shape, np.nan)
+            if len(categories):
+                found = counts.any(axis=2)
+                reduced[found] = categories[np.argmax(counts, axis=2)[found]]
+        else:
+            # each window of a partial result is NaN if it has no values in the block, so partial results can be
+            # combined with fmax, and for the nearest reduction only one block has a value for each window
+            ufunc = np.fmin if self.reduction == "min" else np.fmax
+            reduced = np.full(self.shape, np.nan, dtype=self.dtype)
+            for (_, first, values) in results:
+                window = reduced[first:first + len(values)]
+                ufunc(window, values, out=window)
+        return (nan_count, reduced.astype(self.dtype, copy=False))
+
+    @staticmethod
+    def reduceRows(ufunc,block,starts,sizes,initial,dtype,missing=None):
+        """
+        reduce the rows in each window of a 2D array with a ufunc, a row of every window at a time.  Windows that
+        differ in size cannot be reshaped into a single array, but stepping through the rows of all the windows
+        together only leaves the last row of the larger windows to be reduced separately.
+        :param ufunc: a numpy ufunc such as np.add or np.fmax
+        :param block: a 2D numpy array organised by [y,x]
+        :param starts: the first row of each window
+        :param sizes: the number of rows in each window
+        :param initial: the initial value of each reduced row, which is also used in place of missing values
+        :param dtype: the data type of the reduced rows
+        :param missing: a boolean array marking the values to leave out, the same shape as block (or None)
+        :return: the reduced rows, a 2D numpy array with a row for each window
+        """
+        reduced = np.full((len(starts), block.shape[1]), initial, dtype=dtype)
+        for offset in range(sizes.max()):
+            selected = sizes > offset
+            rows = block[starts[selected] + offset]
+            if missing is not None:
+                np.putmask(rows, missing[starts[selected] + offset], initial)
+            if np.all(selected):
+                ufunc(reduced, rows, out=reduced)
+            else:
+                reduced[selected] = ufunc(reduced[selected], rows)
+        return reduced
+
+
+class Overview:
+    """
+    A multi-resolution overview of a 2D array, holding power-of-two downsampled levels.
+    Each level stores the mean and count of the non-NaN values in each window so that levels can be combined exactly.
+    """
+
+    def __init__(self,metadata,levels=None,path=None):
+        """
+        Create an Overview.  Use Overview.build to compute an overview from an array.
+
+        :param metadata: dictionary with keys "shape", "nan_count" and "levels", describing the overview
+        :param levels: dictionary mapping from level number L to (means,counts) arrays for windows of size 2^L
+        :param path: path to a .npz file to load levels from when they are needed, if levels is None
+        """
+        self.metadata = metadata
+        self.levels = levels
+        self.path = path
+        self.nan_count = metadata["nan_count"]
+
+    def getLevel(self,level):
+        """
+        get the arrays for a level in the overview
+        :param level: the level number L
+        :return: (means,counts) arrays for windows of size 2^L
+        """
+        if self.levels is not None:
+            return self.levels[level]
+        with np.load(self.path, allow_pickle=False) as f:
+            return (f["means_%d" % level], f["counts_%d" % level])
+
+    @staticmethod
+    def build(read,shape,dtype,max_level_cells,min_level_size,max_memory=None):
+        """
+        build an overview of a 2D array, reading it in blocks of rows.  Each block holds whole windows of the
+        coarsest level that fits within max_memory, so the levels up to that one are built from each block in turn
+        and the coarser levels from the concatenated results.
+        :param read: a function taking (start,stop) and returning those rows of the array as a 2D numpy array
+                     organised by [y,x]
+        :param shape: the (height,width) of the array
+        :param dtype: the data type of the array
+        :param max_level_cells: only keep levels with at most this many cells
+        :param min_level_size: stop building levels once both dimensions are at most this size
+        :param max_memory: the maximum number of bytes used to read blocks, and to keep each level (or None to read
+                           the whole array at once)
+        :return: an Overview
+        """
+        (height, width) = shape
+        level_dtype = np.result_type(dtype, np.float32)
+
+        def getLevelShape(level):
+            # each level pads the one below to whole windows
+            return (-(-height // 2 ** level), -(-width // 2 ** level))
+
+        def keep(level):
+            cells = math.prod(getLevelShape(level))
+            return cells <= max_level_cells and \
+                (max_memory is None or cells * (level_dtype.itemsize + 8) <= max_memory)
+
+        # work out the number of levels
+        top_level = 0
+        while max(getLevelShape(top_level)) > min_level_size:
+            top_level += 1
+
+        # allow for the block being read, its means and counts, and the sums (and a padded copy) used to reduce it
+        bytes_per_row = width * (np.dtype(dtype).itemsize + level_dtype.itemsize + 4 + 16)
+        streamed_level = top_level
+        block_height = height
+        if max_memory is not None:
+            while streamed_level > 0 and 2 ** streamed_level * bytes_per_row > max_memory:
+                streamed_level -= 1
+            block_height = max(1, max_memory // (bytes_per_row * 2 ** streamed_level)) * 2 ** streamed_level
+
+        parts = {level: [] for level in range(streamed_level + 1) if keep(level) or level == streamed_level}
+        nan_count = 0
+        for start in range(0, height, block_height):
+            means = read(start, min(height, start + block_height)).astype(level_dtype)
+            counts = (~np.isnan(means)).astype(np.uint32)
+            nan_count += int(means.size - np.count_nonzero(counts))
+            for level in range(streamed_level + 1):
+                if level > 0:
+                    (means, counts) = Overview.reduce(means, counts, 2, 2)
+                    means = means.astype(level_dtype)
+                if level in parts:
+                    parts[level].append((means, counts))
+        all_levels = {level: (np.concatenate([means for (means, _) in blocks]),
+                              np.concatenate([counts for (_, counts) in blocks]))
+                      for (level, blocks) in parts.items()}
+
+        # build the coarser levels from the last level built from the blocks
+        (means, counts) = all_levels[streamed_level]
+        for level in range(streamed_level + 1, top_level + 1):
+            (means, counts) = Overview.reduce(means, counts, 2, 2)
+            means = means.astype(level_dtype)
+            all_levels[level] = (means, counts)
+
+        levels = {}
+        level_metadata = []
+        for level in range(top_level + 1):
+            if not keep(level):
+                continue
+            (means, counts) = levels[level] = all_levels[level]
+            level_metadata.append({"level": level, "shape": list(means.shape),
+                                   "nan_count": int(means.size - np.count_nonzero(counts)),
+                                   "min": float(np.nanmin(means)) if np.any(counts) else None,
+                                   "max": float(np.nanmax(means)) if np.any(counts) else None})
+
+        metadata = {"shape": list(shape), "nan_count": nan_count, "levels": level_metadata}
+        return Overview(metadata, levels)
+
+    @staticmethod
+    def reduce(means,counts,window_size_y,window_size_x):
+        """
+        combine the windows of a level into larger windows, padding the edges
+        :param means: the mean of the non-NaN values in each window, NaN where there are none
+        :param counts: the number of non-NaN values in each window
+        :param window_size_y: the number of windows to combine along the y dimension
+        :param window_size_x: the number of windows to combine along the x dimension
+        :return: (means,counts) for the combined windows
+        """
+        pad_y = -means.shape[0] % window_size_y
+        pad_x = -means.shape[1] % window_size_x
+        sums = np.where(counts > 0, means * counts, 0.0)
+        sums = np.pad(sums, ((0, pad_y), (0, pad_x)))
+        counts = np.pad(counts, ((0, pad_y), (0, pad_x)))
+        (height, width) = (sums.shape[0] // window_size_y, sums.shape[1] // window_size_x)
+        sums = sums.reshape(height, window_size_y, width, window_size_x).sum(axis=(1, 3))
+        counts = counts.reshape(height, window_size_y, width, window_size_x).sum(axis=(1, 3))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts > 0, sums / counts, np.nan)
+        return (means, counts)
+
+    def coarsen(self,edges_y,edges_x):
+        """
+        coarsen the array using the nearest finer level in the overview
+        :param edges_y: the first row of each coarsening window in the original array, followed by the number of rows
+        :param edges_x: the first column of each coarsening window in the original array, followed by the number of
+                        columns
+        :return: the coarsened array organised by [y,x], or None if no suitable level is available
+        """
+        # prefer levels whose windows line up exactly with the original windows, otherwise the nearest finer level
+        stored_levels = [level_metadata["level"] for level_metadata in self.metadata["levels"]]
+        candidates = [level for level in stored_levels
+                      if not np.any(edges_y[:-1] % 2 ** level) and not np.any(edges_x[:-1] % 2 ** level)]
+        if not candidates:
+            smallest = min(np.diff(edges_y).min(), np.diff(edges_x).min())
+            candidates = [level for level in stored_levels if 2 ** level <= smallest]
+        if not candidates:
+            return None
+        level = max(candidates)
+        (means, counts) = self.getLevel(level)
+
+        # assign each cell in the level to the original window containing its centre
+        (height, width) = (len(edges_y) - 1, len(edges_x) - 1)
+        rows = np.searchsorted(edges_y, (np.arange(means.shape[0]) + 0.5) * 2 ** level, side="right") - 1
+        columns = np.searchsorted(edges_x, (np.arange(means.shape[1]) + 0.5) * 2 ** level, side="right") - 1
+        rows = np.minimum(rows, height - 1)
+        columns = np.minimum(columns, width - 1)
+        cells = (rows[:, None] * width + columns[None, :]).ravel()
+
+        sums = np.bincount(cells, weights=np.where(counts > 0, means * counts, 0.0).ravel(), minlength=height * width)
+        totals = np.bincount(cells, weights=counts.ravel(), minlength=height * width)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            coarsened = np.where(totals > 0, sums / totals, np.nan)
+        return coarsened.reshape(height, width)
+
+
+class OverviewCache:
+    """
+    An on-disk cache of Overviews of 2D slices of variables, with a size limit enforced by evicting the least
+    recently used overviews.  Overviews are keyed by file path and modification time, how the file was read,
+    variable, the x and y dimensions and the indices used for other dimensions.
+    """
+
+    default_directory = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+                                     "termplot2d")
+
+    default_max_size = 1024 ** 3
+
+    # only keep levels with at most this many cells, larger levels cost more to store than reading the source
+    max_level_cells = 4 * 1024 * 1024
+
+    # stop building levels once both dimensions are at most this size
+    min_level_size = 32
+
+    def __init__(self,directory=None,max_size=None):
+        """
+        Create an OverviewCache.
+
+        :param directory: the directory to store overviews in (or None to use the default)
+        :param max_size: the maximum total size of the stored overviews in bytes (or None to use the default)
+        """
+        self.directory = directory if directory else OverviewCache.default_directory
+        self.max_size = max_size if max_size is not None else OverviewCache.default_max_size
+
+    def getKey(self,path,var_name,dims,fixed_indices,backend="auto",layout=None):
+        """
+        get the key for an overview
+        :param path: the path of the file containing the variable
+        :param var_name: the name of the variable
+        :param dims: the names of the (y,x) dimensions
+        :param fixed_indices: dictionary mapping from the names of the other dimensions to the index used
+        :param backend: the backend used to read the file, see open_dataset
+        :param layout: (shape,dtype,offset) used to read a raw binary file (or None)
+        :return: (key,description) where key is a file name and description a dictionary describing the overview
+        """
+        import hashlib
+        import json
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        description = {"path": path, "mtime": stat.st_mtime_ns, "size": stat.st_size, "backend": backend,
+                       "layout": layout, "variable": var_name, "dimensions": list(dims), "indices": fixed_indices}
+        key = hashlib.sha1(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest() + ".npz"
+        return (key, description)
+
+    def load(self,path,var_name,dims,fixed_indices,backend="auto",layout=None):
+        """
+        load an overview from the cache
+        :param path: the path of the file containing the variable
+        :param var_name: the name of the variable
+        :param dims: the names of the (y,x) dimensions
+        :param fixed_indices: dictionary mapping from the names of the other dimensions to the index used
+        :param backend: the backend used to read the file, see open_dataset
+        :param layout: (shape,dtype,offset) used to read a raw binary file (or None)
+        :return: the Overview, or None if it is not cached
+        """
+        import json
+        (key, _) = self.getKey(path, var_name, dims, fixed_indices, backend, layout)
+        cache_path = os.path.join(self.directory, key)
+        try:
+            with np.load(cache_path, allow_pickle=False) as f:
+                metadata = json.loads(str(f["metadata"]))
+        except (OSError, KeyError, ValueError):
+            return None
+        # record the use of the overview for least recently used eviction
+        os.utime(cache_path)
+        # levels are read from the file only when needed
+        return Overview(metadata, path=cache_path)
+
+    def store(self,path,var_name,dims,fixed_indices,read,shape,dtype,backend="auto",layout=None,max_memory=None):
+        """
+        build an overview of a 2D array and store it in the cache
+        :param path: the path of the file containing the variable
+        :param var_name: the name of the variable
+        :param dims: the names of the (y,x) dimensions
+        :param fixed_indices: dictionary mapping from the names of the other dimensions to the index used
+        :param read: a function taking (start,stop) and returning those rows of the array as a 2D numpy array
+                     organised by [y,x]
+        :param shape: the (height,width) of the array
+        :param dtype: the data type of the array
+        :param backend: the backend used to read the file, see open_dataset
+        :param layout: (shape,dtype,offset) used to read a raw binary file (or None)
+        :param max_memory: the maximum number of bytes used to build the overview (or None for no limit)
+        :return: the Overview
+        """
+        import json
+        (key, description) = self.getKey(path, var_name, dims, fixed_indices, backend, layout)
+        overview = Overview.build(read, shape, dtype, OverviewCache.max_level_cells, OverviewCache.min_level_size,
+                                  max_memory)
+        overview.metadata.update(description)
+
+        arrays = {"metadata": np.array(json.dumps(overview.metadata))}
+        for (level, (means, counts)) in overview.levels.items():
+            arrays["means_%d" % level] = means
+            arrays["counts_%d" % level] = counts
+
+        # write to a temporary file first so that readers never see a partially written overview
+        os.makedirs(self.directory, exist_ok=True)
+        cache_path = os.path.join(self.directory, key)
+        temp_path = cache_path + ".%d.tmp" % os.getpid()
+        with open(temp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, cache_path)
+
+        self.evict()
+        return overview
+
+    def evict(self):
+        """
+        remove the least recently used overviews until the cache is within its maximum size
+        """
+        # overviews that could never fit are removed first, then the least recently used
+        entries = sorted(self.list(), key=lambda entry: (entry["bytes"] <= self.max_size, entry["last_used"]))
+        total_size = sum(entry["bytes"] for entry in entries)
+        while entries and total_size > self.max_size:
+            entry = entries.pop(0)
+            os.remove(entry["cache_path"])
+            total_size -= entry["bytes"]
+
+    def list(self):
+        """
+        list the overviews in the cache
+        :return: a list of dictionaries describing each overview, with keys
+                 "cache_path", "bytes", "last_used", "path", "variable", "indices", "shape" and "levels"
+        """
+        import json
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            if not name.endswith(".npz"):
+                continue
+            cache_path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(cache_path)
+                with np.load(cache_path, allow_pickle=False) as f:
+                    metadata = json.loads(str(f["metadata"]))
+            except (OSError, KeyError, ValueError):
+                continue
+            metadata.update({"cache_path": cache_path, "bytes": stat.st_size, "last_used": stat.st_mtime})
+            entries.append(metadata)
+        return entries
+
+    def clear(self):
+        """
+        remove all overviews from the cache
+        """
+        for entry in self.list():
+            os.remove(entry["cache_path"])
+
+    def report(self):
+        """
+        describe the contents of the cache
+        :return: a printable summary, one line per overview, most recently used first
+        """
+        import time
+        entries = sorted(self.list(), key=lambda entry: entry["last_used"], reverse=True)
+        lines = ["cache %s: %d overviews, %.1f of %.1f MB" % (
+            self.directory, len(entries), sum(entry["bytes"] for entry in entries) / 1024 ** 2,
+            self.max_size / 1024 ** 2)]
+        for entry in entries:
+            indices = ",".join("%s=%d" % (dim, index) for (dim, index) in sorted(entry["indices"].items()))
+            lines.append("%s %s:%s%s (w:%d,h:%d) levels:%s %.1f MB" % (
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["last_used"])),
+                entry["path"], entry["variable"], "[" + indices + "]" if indices else "",
+                entry["shape"][1], entry["shape"][0],
+                ",".join(str(level["level"]) for level in entry["levels"]), entry["bytes"] / 1024 ** 2))
+        return "\n".join(lines)
+
+
+class ArrayCache:
+    """
+    An in-memory cache of coarsened 2D slices of variables, with a size limit enforced by evicting the least
+    recently used arrays.  Arrays are keyed by file path and modification time, how the file was read, variable,
+    the x and y dimensions, the indices used for other dimensions, the sampling strides and how the variable is
+    coarsened.
+    Can be shared between threads.
+    """
+
+    default_max_size = 512 * 1024 ** 2
+
+    def __init__(self,max_size=None):
+        """
+        Create an ArrayCache.
+
+        :param max_size: the maximum total size of the cached arrays in bytes (or None to use the default)
+        """
+        import collections
+        self.max_size = max_size if max_size is not None else ArrayCache.default_max_size
+        self.arrays = collections.OrderedDict() # mapping from key to (nan_fraction,array), least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def getKey(path,var_name,dims,fixed_indices,strides,reduction,cells,backend="auto",layout=None):
+        """
+        get the key for a coarsened array
+        :param path: the path of the file containing the variable
+        :param var_name: the name of the variable
+        :param dims: the names of the (y,x) dimensions
+        :param fixed_indices: dictionary mapping from the names of the other dimensions to the index used
+        :param strides: the (y,x) sampling strides
+        :param reduction: how the values in each coarsening window are reduced
+        :param cells: the (y,x) numbers of cells the variable is coarsened to
+        :param backend: the backend used to read the file, see open_dataset
+        :param layout: (shape,dtype,offset) used to read a raw binary file (or None)
+        :return: the key
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size, backend, layout, var_name, tuple(dims),
+                tuple(sorted(fixed_indices.items())), tuple(strides), reduction, tuple(cells))
+
+    def get(self,key):
+        """
+        get a coarsened array from the cache
+        :param key: the key, from getKey
+        :return: (nan_fraction,array), or None if the array is not cached
+        """
+        with self.lock:
+            entry = self.arrays.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.arrays.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self,key,nan_fraction,arr):
+        """
+        add a coarsened array to the cache, removing the least recently used arrays if the cache is full
+        :param key: the key, from getKey
+        :param nan_fraction: the fraction of the values of the variable that are NaN
+        :param arr: the coarsened numpy array, which is shared by later plots and so must not be modified
+        """
+        if arr.nbytes > self.max_size:
+            return
+        with self.lock:
+            if key in self.arrays:
+                self.size -= self.arrays.pop(key)[1].nbytes
+            self.arrays[key] = (nan_fraction, arr)
+            self.size += arr.nbytes
+            while self.size > self.max_size:
+                (_, (_, evicted)) = self.arrays.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def report(self):
+        """
+        describe the contents of the cache
+        :return: a printable summary
+        """
+        with self.lock:
+            return "array cache: %d arrays, %.1f of %.1f MB, %d hits, %d misses" % (
+                len(self.arrays), self.size / 1024 ** 2, self.max_size / 1024 ** 2, self.hits, self.misses)
+
+
+class NetCDFSource:
+    """
+    A read-only source of variables in a netcdf file, read directly with the netCDF4 library so that xarray (and
+    pandas) need not be imported.  Provides the parts of the xarray Dataset interface used by TermPlotter:
+    variables, sizes, encoding["source"], indexing by variable name and use as a context manager.
+    Missing values and scale factors are decoded following the CF conventions, as xarray does by default.
+    """
+
+    # the netCDF4 library is not thread safe, all calls to it (for any file) are serialised
+    lock = threading.RLock()
+
+    def __init__(self,path):
+        """
+        Create a NetCDFSource.
+
+        :param path: the path of the netcdf file
+        """
+        import netCDF4
+        with NetCDFSource.lock:
+            self.nc = netCDF4.Dataset(path)
+            # variables are decoded by NetCDFArray rather than by the netCDF4 library
+            self.nc.set_auto_maskandscale(False)
+            self.encoding = {"source": os.path.abspath(path),
+                             "unlimited_dims": {name for (name, dimension) in self.nc.dimensions.items()
+                                                if dimension.isunlimited()}}
+            self.sizes = {name: len(dimension) for (name, dimension) in self.nc.dimensions.items()}
+            self.variables = {name: NetCDFArray(variable, NetCDFSource.lock)
+                              for (name, variable) in self.nc.variables.items()}
+
+    def __getitem__(self,var_name):
+        return self.variables[var_name]
+
+    def __contains__(self,var_name):
+        return var_name in self.variables
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+    def close(self):
+        with NetCDFSource.lock:
+            self.nc.close()
+
+
+class NetCDFArray:
+    """
+    A lazily indexed view of a variable in a NetCDFSource or ArraySource.  Provides the parts of the xarray
+    DataArray interface used by TermPlotter: dims, shape, sizes, dtype, size, nbytes, positional indexing, isel,
+    transpose, load, data and values.  Indexing and transposing create new views without reading, values are read
+    when needed.
+    """
+
+    def __init__(self,variable,lock,key=None,order=None,values=None):
+        """
+        Create a NetCDFArray.
+
+        :param variable: a netCDF4 Variable, or an ArrayVariable
+        :param lock: a lock held while reading from the variable
+        :param key: for each dimension of the variable, an index or a slice with explicit start, stop and step
+                    (or None to select the whole variable)
+        :param order: the order of the sliced dimensions in this view (or None to keep the variable's order)
+        :param values: the values of this view, if they have already been read
+        """
+        self.variable = variable
+        self.lock = lock
+        # reading the shape and attributes of the variable calls the netCDF4 library
+        with lock:
+            variable_shape = variable.shape
+            attributes = {name: variable.getncattr(name) for name in variable.ncattrs()}
+            raw_dtype = variable.dtype
+        self.key = key if key is not None else tuple(slice(0, size, 1) for size in variable_shape)
+        # the dimensions of the variable that are sliced, rather than indexed
+        self.axes = [axis for axis in range(len(self.key)) if isinstance(self.key[axis], slice)]
+        self.order = order if order is not None else list(range(len(self.axes)))
+        self.dims = tuple(variable.dimensions[self.axes[position]] for position in self.order)
+        self.shape = tuple(len(range(self.key[self.axes[position]].start, self.key[self.axes[position]].stop,
+                                     self.key[self.axes[position]].step)) for position in self.order)
+        self.loaded = values
+
+        # work out how values are decoded, see getValues
+        self.fill_values = [attributes[name] for name in ("_FillValue", "missing_value") if name in attributes]
+        self.scaled = "scale_factor" in attributes or "add_offset" in attributes
+        self.scale_factor = attributes.get("scale_factor")
+        self.add_offset = attributes.get("add_offset")
+        self.unsigned = str(attributes["_Unsigned"]).lower() == "true" if "_Unsigned" in attributes else False
+        if self.unsigned and raw_dtype.kind == "i":
+            raw_dtype = np.dtype(raw_dtype.str.replace("i", "u"))
+        if self.scaled or self.fill_values and raw_dtype.kind in "iu":
+            # values are converted to floating point, so that missing values can be set to NaN
+            if raw_dtype.kind == "f" and raw_dtype.itemsize <= 4 or raw_dtype.kind in "iu" and raw_dtype.itemsize <= 2:
+                self.dtype = np.dtype(np.float32)
+            else:
+                self.dtype = np.dtype(np.float64)
+        else:
+            self.dtype = raw_dtype
+
+    @property
+    def sizes(self):
+        return dict(zip(self.dims, self.shape))
+
+    @property
+    def size(self):
+        return math.prod(self.shape)
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    @property
+    def chunks(self):
+        """
+        the number of elements of this view in each chunk of the variable, along each dimension of this view,
+        or None if the variable is not stored in chunks
+        """
+        with self.lock:
+            chunking = self.variable.chunking()
+        if not isinstance(chunking, (list, tuple)):
+            return None
+        return tuple(math.ceil(chunking[self.axes[position]] / self.key[self.axes[position]].step)
+                     for position in self.order)
+
+    @property
+    def compressed(self):
+        """
+        true if the variable is stored in compressed chunks, so that reading part of a chunk decompresses all of it
+        """
+        if isinstance(self.variable, ArrayVariable):
+            return self.variable.compressed
+        with self.lock:
+            filters = self.variable.filters()
+        return bool(filters) and any(filters.get(name) for name in ("zlib", "szip", "zstd", "bzip2", "blosc"))
+
+    @property
+    def streamed(self):
+        """
+        true if the variable should always be read in blocks, so that memory use stays close to the size of the
+        plot rather than the size of the variable, as for memory mapped and Zarr arrays
+        """
+        return isinstance(self.variable, ArrayVariable)
+
+    def __getitem__(self,key):
+        """
+        select part of this view
+        :param key: an index or slice for each dimension of this view, trailing dimensions may be omitted
+        :return: a new NetCDFArray
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        key = key + (slice(None),) * (len(self.dims) - len(key))
+
+        # apply the key to the ranges of the variable selected by this view
+        variable_key = list(self.key)
+        for (position, index) in zip(self.order, key):
+            axis = self.axes[position]
+            selected = range(self.key[axis].start, self.key[axis].stop, self.key[axis].step)[index]
+            variable_key[axis] = selected if isinstance(selected, int) else \
+                slice(selected.start, selected.stop, selected.step)
+
+        # keep the remaining dimensions in the same order as in this view
+        axes = [axis for axis in range(len(variable_key)) if isinstance(variable_key[axis], slice)]
+        order = [axes.index(self.axes[position]) for (position, index) in zip(self.order, key)
+                 if isinstance(index, slice)]
+        return NetCDFArray(self.variable, self.lock, tuple(variable_key), order)
+
+    def isel(self,indexers):
+        """
+        select part of this view by dimension name
+        :param indexers: dictionary mapping from dimension names to an index or slice
+        :return: a new NetCDFArray
+        """
+        return self[tuple(indexers.get(dim, slice(None)) for dim in self.dims)]
+
+    def transpose(self,*dims):
+        """
+        reorder the dimensions of this view
+        :param dims: the names of the dimensions, in the new order
+        :return: a new NetCDFArray
+        """
+        permutation = [self.dims.index(dim) for dim in dims]
+        values = np.transpose(self.loaded, permutation) if self.loaded is not None else None
+        return NetCDFArray(self.variable, self.lock, self.key, [self.order[index] for index in permutation], values)
+
+    def load(self):
+        """
+        read the values of this view, so that later uses do not read them again
+        :return: this NetCDFArray
+        """
+        if self.loaded is None:
+            self.loaded = self.getValues()
+        return self
+
+    @property
+    def values(self):
+        return self.loaded if self.loaded is not None else self.getValues()
+
+    @property
+    def data(self):
+        return self.values
+
+    def getValues(self):
+        """
+        read and decode the values of this view, replacing fill values with NaN and applying any scale factor
+        and offset
+        :return: a numpy array
+        """
+        with self.lock:
+            raw = np.asarray(self.variable[self.key])
+        if self.unsigned and raw.dtype.kind == "i":
+            raw = raw.view(raw.dtype.str.replace("i", "u"))
+        # NaN fill values need no decoding
+        fill_values = [value for value in self.fill_values if not np.isnan(value)]
+        if self.scaled or self.fill_values and raw.dtype.kind in "iu":
+            values = raw.astype(self.dtype)
+            if fill_values:
+                values[np.isin(raw, np.asarray(fill_values).astype(raw.dtype))] = np.nan
+            if self.scale_factor is not None:
+                values *= self.scale_factor
+            if self.add_offset is not None:
+                values += self.add_offset
+        elif fill_values and raw.dtype.kind == "f":
+            values = np.where(np.isin(raw, fill_values), np.nan, raw)
+        else:
+            values = raw
+        return np.transpose(values, self.order)
+
+
+class ArrayVariable:
+    """
+    A numpy array (usually a memory map) or Zarr array with named dimensions.  Provides the parts of the netCDF4
+    Variable interface used by NetCDFArray: dimensions, shape, dtype, attributes, chunking and indexing.
+    """
+
+    def __init__(self,array,dimensions,attributes=None,chunks=None,compressed=False):
+        """
+        Create an ArrayVariable.
+
+        :param array: the array, which is only read when indexed
+        :param dimensions: the names of the dimensions of the array
+        :param attributes: dictionary of attributes, such as _FillValue or scale_factor (or None)
+        :param chunks: the size of the chunks the array is stored in, along each dimension (or None if it is not
+                       stored in chunks)
+        :param compressed: True if the chunks are compressed (or otherwise encoded), so that each chunk must be
+                           decoded whole
+        """
+        self.array = array
+        self.dimensions = tuple(dimensions)
+        self.shape = tuple(array.shape)
+        self.dtype = np.dtype(array.dtype)
+        self.attributes = attributes if attributes else {}
+        self.chunks = chunks
+        self.compressed = compressed
+
+    def ncattrs(self):
+        return list(self.attributes)
+
+    def getncattr(self,name):
+        return self.attributes[name]
+
+    def chunking(self):
+        return list(self.chunks) if self.chunks else "contiguous"
+
+    def __getitem__(self,key):
+        """
+        read part of the array
+        :param key: an index or a slice with explicit start, stop and step for each dimension
+        :return: a numpy array
+        """
+        rows = range(self.shape[0])[key[0]] if isinstance(self.array, np.memmap) else None
+        if rows is None or not self.array.flags.c_contiguous or isinstance(rows, range) and rows.step < 0:
+            return np.asarray(self.array[key])
+        # map only the rows of the file that are selected and copy their values, so that the pages read are released
+        # when the map is closed rather than staying resident for as long as the file is open
+        if isinstance(rows, int):
+            (start, stop, selected) = (rows, rows + 1, 0)
+        elif len(rows) == 0:
+            return np.asarray(self.array[key])
+        else:
+            (start, stop) = (rows[0], rows[-1] + 1)
+            selected = slice(0, stop - start, rows.step)
+        row_size = self.dtype.itemsize * math.prod(self.shape[1:])
+        part = np.memmap(self.array.filename, dtype=self.dtype, mode="r", offset=self.array.offset + start * row_size,
+                         shape=(stop - start,) + self.shape[1:])
+        return np.array(part[(selected,) + tuple(key[1:])])
+
+
+class ArraySource:
+    """
+    A read-only source of arrays stored in a numpy .npy file, a raw binary file or a Zarr store.  The arrays are
+    read directly, from memory maps or chunk by chunk, without converting the file.  Provides the same interface as
+    NetCDFSource.  The last two dimensions of .npy and raw arrays are named y and x and any others dim_0, dim_1 and
+    so on, and the array is named after the file.  Zarr arrays written by xarray keep their dimension names.
+    """
+
+    # the files that identify a directory as a Zarr store
+    zarr_metadata = (".zarray", ".zgroup", "zarr.json")
+
+    def __init__(self,path,arrays):
+        """
+        Create an ArraySource.  Use openNpy, openRaw or openZarr to open a file.
+
+        :param path: the path of the file or store
+        :param arrays: dictionary mapping from variable names to ArrayVariables
+        """
+        import contextlib
+        self.encoding = {"source": os.path.abspath(path), "unlimited_dims": set()}
+        self.sizes = {}
+        for variable in arrays.values():
+            self.sizes.update(zip(variable.dimensions, variable.shape))
+        # memory maps and Zarr arrays can be read by several threads at once
+        lock = contextlib.nullcontext()
+        self.variables = {name: NetCDFArray(variable, lock) for (name, variable) in arrays.items()}
+
+    @staticmethod
+    def getName(path):
+        return os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+
+    @staticmethod
+    def getDimensions(ndim):
+        return ["dim_%d" % axis for axis in range(ndim - 2)] + ["y", "x"][max(0, 2 - ndim):]
+
+    @staticmethod
+    def openNpy(path):
+        """
+        open a numpy .npy file, memory mapping the array
+        :param path: the path of the file
+        :return: an ArraySource
+        """
+        array = np.load(path, mmap_mode="r")
+        variable = ArrayVariable(array, ArraySource.getDimensions(array.ndim))
+        return ArraySource(path, {ArraySource.getName(path): variable})
+
+    @staticmethod
+    def openRaw(path,shape,dtype="float32",offset=0):
+        """
+        open a raw binary file containing an array in C (row major) order, memory mapping the array
+        :param path: the path of the file
+        :param shape: the size of each dimension of the array
+        :param dtype: the numpy data type of the array, such as float32 or >i2
+        :param offset: the number of bytes before the start of the array in the file
+        :return: an ArraySource
+        """
+        array = np.memmap(path, dtype=np.dtype(dtype), mode="r", offset=offset, shape=tuple(shape))
+        variable = ArrayVariable(array, ArraySource.getDimensions(array.ndim))
+        return ArraySource(path, {ArraySource.getName(path): variable})
+
+    @staticmethod
+    def openZarr(path):
+        """
+        open a Zarr store containing an array or a group of arrays, decoding missing values and scale factors as
+        xarray would
+        :param path: the path of the store
+        :return: an ArraySource
+        """
+        import zarr
+        store = zarr.open(path, mode="r")
+        arrays = dict(store.arrays()) if isinstance(store, zarr.Group) else {ArraySource.getName(path): store}
+        variables = {}
+        for (name, array) in arrays.items():
+            attributes = dict(array.attrs)
+            metadata = getattr(array, "metadata", None)
+            # dimension names are stored in an attribute by xarray for Zarr format 2, and in the metadata for format 3
+            dimensions = attributes.pop("_ARRAY_DIMENSIONS", None) or getattr(metadata, "dimension_names", None)
+            if not dimensions or None in dimensions:
+                dimensions = ArraySource.getDimensions(array.ndim)
+            # in Zarr format 2 the fill value marks missing values, in format 3 only a _FillValue attribute does
+            if getattr(metadata, "zarr_format", 2) == 2 and array.fill_value is not None:
+                attributes.setdefault("_FillValue", array.fill_value)
+            if isinstance(attributes.get("_FillValue"), str):
+                # JSON has no NaN, xarray writes floating point fill values as a string (NaN) or base64 encoded
+                try:
+                    attributes["_FillValue"] = float(attributes["_FillValue"])
+                except ValueError:
+                    import base64
+                    attributes["_FillValue"] = np.frombuffer(base64.b64decode(attributes["_FillValue"]),
+                                                             dtype=np.dtype(array.dtype))[0]
+            # Zarr 3 lists the compressors, Zarr 2 has at most one compressor.  Filters also encode whole chunks
+            compressors = getattr(array, "compressors", None)
+            if compressors is None:
+                compressors = [array.compressor] if array.compressor is not None else []
+            compressed = bool(compressors) or bool(getattr(array, "filters", None))
+            variables[name] = ArrayVariable(array, dimensions, attributes, array.chunks, compressed)
+        return ArraySource(path, variables)
+
+    def __getitem__(self,var_name):
+        return self.variables[var_name]
+
+    def __contains__(self,var_name):
+        return var_name in self.variables
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        self.close()
+
+    def close(self):
+        # memory maps are closed when the arrays are no longer used
+        self.variables = {}
+
+
+class PlotProfiler:
+    """
+    Records the wall time taken by each stage of plotting each variable, along with the bytes read and the shapes
+    of arrays.  Pass a PlotProfiler to a TermPlotter to enable profiling.
+    """
+
+    def __init__(self):
+        """
+        Create a PlotProfiler.
+        """
+        self.records = [] # one dictionary per timed stage, in the order the stages finished
+        self.colour_lookups = 0
+        self.colour_cache_hits = 0
+        self.lock = threading.Lock()
+
+    def stage(self,stage,var_name=None):
+        """
+        time a stage of plotting
+        :param stage: the name of the stage, such as "read" or "coarsen"
+        :param var_name: the variable being plotted, or None for stages that are not specific to a variable
+        :return: a context manager which times the code it encloses, yielding a dictionary which the enclosed code
+                 can add other measurements to, such as "bytes" or "shape"
+        """
+        import contextlib
+        import time
+
+        @contextlib.contextmanager
+        def timer():
+            record = {"stage": stage, "variable": var_name}
+            start = time.perf_counter()
+            try:
+                yield record
+            finally:
+                record["seconds"] = time.perf_counter() - start
+                with self.lock:
+                    self.records.append(record)
+        return timer()
+
+    def countColourLookup(self,hit):
+        """
+        count a lookup of the closest colour to an (r,g,b) value
+        :param hit: true if the colour was found in the plotter's cache of colours
+        """
+        with self.lock:
+            self.colour_lookups += 1
+            self.colour_cache_hits += 1 if hit else 0
+
+    def report(self,format="table"):
+        """
+        describe the recorded stages
+        :param format: "table" for a summary table, totalled by variable and stage, or "json" for one JSON
+                       object per recorded stage
+        :return: the printable report
+        """
+        import json
+        colour_cache = {"lookups": self.colour_lookups, "hits": self.colour_cache_hits,
+                        "hit_rate": self.colour_cache_hits / self.colour_lookups if self.colour_lookups else None}
+        if format == "json":
+            lines = [json.dumps(record) for record in self.records]
+            lines.append(json.dumps({"stage": "colour_cache", **colour_cache}))
+            return "\n".join(lines)
+
+        # total the stages for each variable, in the order they were first recorded
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault((record["variable"], record["stage"]), {"calls": 0, "seconds": 0, "bytes": 0})
+            total["calls"] += 1
+            total["seconds"] += record["seconds"]
+            total["bytes"] += record.get("bytes", 0)
+            if "shape" in record:
+                total["shape"] = record["shape"]
+
+        lines = ["%-16s %-12s %6s %10s %12s  %s" % ("variable", "stage", "calls", "seconds", "bytes", "shape")]
+        for ((var_name, stage), total) in totals.items():
+            lines.append("%-16s %-12s %6d %10.4f %12s  %s" % (
+                var_name if var_name is not None else "-", stage, total["calls"], total["seconds"],
+                total["bytes"] if total["bytes"] else "", total.get("shape", "")))
+        lines.append("total %.4f seconds, %d bytes read" % (
+            sum(record["seconds"] for record in self.records), sum(record.get("bytes", 0) for record in self.records)))
+        if self.colour_lookups:
+            lines.append("colour cache: %d lookups, %.1f%% hits" % (self.colour_lookups,
+                                                                     100 * colour_cache["hit_rate"]))
+        return "\n".join(lines)
+
+
+class DatasetPool:
+    """
+    A pool of open datasets, shared between threads, which keeps recently used files open so that they need not be
+    opened again for each plot.  At most max_open datasets are kept open, closing the least recently used datasets
+    that are not in use.  Files that have changed since they were opened are opened again.
+    """
+
+    default_max_open = 8
+
+    def __init__(self,max_open=None):
+        """
+        Create a DatasetPool.
+
+        :param max_open: the maximum number of datasets to keep open (or None to use the default)
+        """
+        import collections
+        self.max_open = max_open if max_open is not None else DatasetPool.default_max_open
+        # mapping from (path,backend,layout) to a dictionary with the open dataset "ds", the "stat" of the file when it
+        # was opened and the number of "users", least recently used first
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def open(self,path,backend="auto",layout=None):
+        """
+        use a dataset from the pool, opening it if it is not already open
+        :param path: the path of the file
+        :param backend: how to open the file, see open_dataset
+        :param layout: (shape,dtype,offset) to read a raw binary file, see open_dataset (or None)
+        :return: a context manager yielding the dataset, which is returned to the pool when the context exits
+        """
+        import contextlib
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (path, backend, layout)
+
+        @contextlib.contextmanager
+        def use():
+            with self.lock:
+                entry = self.getEntry(key, stat)
+                if entry is not None:
+                    self.acquire(key, entry)
+            if entry is None:
+                # open the file without holding the lock, so that requests for other files are not kept waiting
+                ds = open_dataset(path, backend, layout)
+                with self.lock:
+                    entry = self.getEntry(key, stat)
+                    if entry is None:
+                        entry = {"ds": ds, "stat": (stat.st_mtime_ns, stat.st_size), "users": 0}
+                        self.entries[key] = entry
+                        ds = None
+                    self.acquire(key, entry)
+                if ds is not None:
+                    # another thread opened the same file at the same time, use the dataset it opened
+                    ds.close()
+            try:
+                yield entry["ds"]
+            finally:
+                with self.lock:
+                    entry["users"] -= 1
+                    if self.entries.get(key) is entry:
+                        self.evict()
+                    else:
+                        self.release(entry)
+        return use()
+
+    def getEntry(self,key,stat):
+        """
+        get the entry of an open dataset, removing it from the pool if the file has changed since it was opened
+        (call while holding the lock)
+        :param key: the (path,backend,layout) of the dataset
+        :param stat: the current os.stat of the file
+        :return: the entry, or None if the dataset is not open
+        """
+        entry = self.entries.get(key)
+        if entry is not None and entry["stat"] != (stat.st_mtime_ns, stat.st_size):
+            # the file has changed, it is closed once it is no longer in use
+            del self.entries[key]
+            self.release(entry)
+            entry = None
+        return entry
+
+    def acquire(self,key,entry):
+        """
+        mark a dataset in the pool as in use and most recently used (call while holding the lock)
+        :param key: the (path,backend,layout) of the dataset
+        :param entry: the entry of the dataset
+        """
+        self.entries.move_to_end(key)
+        entry["users"] += 1
+        self.evict()
+
+    def release(self,entry):
+        """
+        close a dataset that has been removed from the pool, if it is not in use (call while holding the lock)
+        :param entry: the entry of the dataset
+        """
+        if entry["users"] == 0:
+            entry["ds"].close()
+
+    def evict(self):
+        """
+        close the least recently used datasets that are not in use, until at most max_open datasets are open
+        (call while holding the lock)
+        """
+        for key in [key for (key, entry) in self.entries.items() if entry["users"] == 0]:
+            if len(self.entries) <= self.max_open:
+                break
+            self.release(self.entries.pop(key))
+
+    def close(self):
+        """
+        close all the datasets in the pool
+        """
+        with self.lock:
+            while self.entries:
+                self.entries.popitem()[1]["ds"].close()
+
+
+class ThreadOutput:
+    """
+    A replacement for sys.stdout which collects what each thread prints while it is capturing, so that the messages
+    printed while plotting for a client can be returned to that client.  Other output is written to the stream.
+    """
+
+    def __init__(self,stream):
+        """
+        Create a ThreadOutput.
+
+        :param stream: the stream to write output to when the thread is not capturing
+        """
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self,s):
+        buffer = getattr(self.local, "buffer", None)
+        return (buffer if buffer is not None else self.stream).write(s)
+
+    def flush(self):
+        self.stream.flush()
+
+    def capture(self):
+        """
+        capture the output of the current thread
+        :return: a context manager yielding a StringIO containing the output
+        """
+        import contextlib
+        import io
+
+        @contextlib.contextmanager
+        def capturing():
+            self.local.buffer = io.StringIO()
+            try:
+                yield self.local.buffer
+            finally:
+                self.local.buffer = None
+        return capturing()
+
+
+class PlotServer:
+    """
+    A server which makes plots for clients (see PlotClient) connecting to a Unix socket.  Recently used datasets are
+    kept open in a DatasetPool and coarsened variables in an ArrayCache, so that repeated plots of the same data
+    need neither open nor read the file.  Each connection is served by its own thread, so that several clients can
+    be served at once.  Requests and responses are JSON objects, one per line.
+    """
+
+    def __init__(self,socket_path,max_open=None,max_memory=None,cache=None,mode=0o600):
+        """
+        Create a PlotServer.
+
+        :param socket_path: the path of the Unix socket to listen on
+        :param max_open: the maximum number of datasets to keep open (or None to use the default)
+        :param max_memory: the maximum size in bytes of the coarsened variables kept in memory (or None to use the
+                           default)
+        :param cache: an OverviewCache used to store and reuse downsampled copies of variables (or None)
+        :param mode: the permissions of the socket, which control who can connect to the server
+        """
+        self.socket_path = socket_path
+        self.mode = mode
+        self.datasets = DatasetPool(max_open)
+        self.array_cache = ArrayCache(max_memory)
+        self.cache = cache
+        self.output = ThreadOutput(sys.stdout)
+
+    def plot(self,request):
+        """
+        plot a page for a client
+        :param request: dictionary with the "path" of the file, the "backend" used to open it, the "layout" of a
+                        raw binary file (or None), the "variables" to plot, the "options" (keyword arguments for
+                        TermPlotter) and the index of the "page" to plot, or None to only count the pages
+        :return: dictionary with the number of "pages", the "plot" (or None), the "messages" printed while
+                 plotting and an "error" (or None if the page was plotted)
+        """
+        with self.output.capture() as messages:
+            try:
+                # JSON has no tuples, the layout is converted back to one so that it can be used as a key
+                layout = request.get("layout")
+                layout = (tuple(layout[0]), layout[1], layout[2]) if layout else None
+                with self.datasets.open(request["path"], request.get("backend", "auto"), layout) as ds:
+                    options = dict(request.get("options", {}), cache=self.cache, array_cache=self.array_cache)
+                    tp = TermPlotter(ds, **options)
+                    pages = tp.getPages(list(request.get("variables", [])))
+                    page = request.get("page")
+                    plot = tp.plotPage(pages[page]) if page is not None else None
+                return {"pages": len(pages), "plot": plot, "messages": messages.getvalue().strip(), "error": None}
+            except (Exception, SystemExit) as ex:
+                # TermPlotter prints the reason before exiting, other errors are described by the exception
+                error = messages.getvalue().strip() + ("" if isinstance(ex, SystemExit) else " " + str(ex))
+                return {"pages": 0, "plot": None, "messages": "", "error": error.strip() or "unable to plot"}
+
+    def handle(self,connection):
+        """
+        serve the requests made on a connection, until the client closes it
+        :param connection: the connected socket
+        """
+        import json
+        import time
+        try:
+            with connection, connection.makefile("rw", encoding="utf-8") as stream:
+                for line in stream:
+                    start = time.perf_counter()
+                    try:
+                        request = json.loads(line)
+                    except ValueError:
+                        request = None
+                    if isinstance(request, dict) and "path" in request:
+                        response = self.plot(request)
+                    else:
+                        response = {"pages": 0, "plot": None, "messages": "", "error": "request not recognized"}
+                    stream.write(json.dumps(response) + "\n")
+                    stream.flush()
+                    if isinstance(request, dict):
+                        sys.stderr.write("%s page %s: %s in %.3f seconds\n" % (
+                            request.get("path"), request.get("page"), response["error"] or "ok",
+                            time.perf_counter() - start))
+        except OSError:
+            # the client went away
+            pass
+
+    def run(self):
+        """
+        listen for connections and serve them, until interrupted
+        """
+        import signal
+        import socket
+        # stop cleanly when terminated, as well as when interrupted
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if os.path.exists(self.socket_path):
+            # remove the socket left by a server that has stopped, but not one that is still listening
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.socket_path)
+                    print("A plot server is already listening on %s" % self.socket_path)
+                    sys.exit(-1)
+                except ConnectionRefusedError:
+                    os.remove(self.socket_path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # create the socket with its permissions already set, so that nobody else can connect in the meantime.
+        # Files are read with the server's permissions, by default only the user running the server can connect
+        umask = os.umask(0o777 & ~self.mode)
+        try:
+            listener.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        listener.listen()
+        sys.stdout = self.output
+        sys.stderr.write("serving plots on %s\n" % self.socket_path)
+        try:
+            while True:
+                (connection, _) = listener.accept()
+                threading.Thread(target=self.handle, args=(connection,), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            os.remove(self.socket_path)
+            sys.stdout = self.output.stream
+            self.datasets.close()
+            sys.stderr.write(self.array_cache.report() + "\n")
+
+
+class PlotClient:
+    """
+    A client of a PlotServer, which sends the file, variables and options of a plot to the server and receives the
+    plotted pages.  Provides the parts of the PlotPager interface used to display the pages: len, get and close.
+    """
+
+    def __init__(self,socket_path,request):
+        """
+        Create a PlotClient, connecting to the server and counting the pages to plot.
+
+        :param socket_path: the path of the server's Unix socket
+        :param request: dictionary with the "path" of the file, the "backend" used to open it, the "layout" of a
+                        raw binary file, the "variables" to plot and the "options" (keyword arguments for
+                        TermPlotter), see PlotServer.plot
+        """
+        import socket
+        self.request = request
+        self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.connection.connect(socket_path)
+        except OSError as ex:
+            print("Unable to connect to a plot server on %s: %s" % (socket_path, ex.strerror))
+            sys.exit(-1)
+        self.stream = self.connection.makefile("rw", encoding="utf-8")
+        response = self.send(None)
+        if response["messages"]:
+            print(response["messages"])
+        self.page_count = response["pages"]
+
+    def __len__(self):
+        return self.page_count
+
+    def send(self,page):
+        """
+        send a request to the server and wait for the response, exiting if the page could not be plotted
+        :param page: the index of the page to plot, or None to count the pages
+        :return: the response, see PlotServer.plot
+        """
+        import json
+        self.stream.write(json.dumps(dict(self.request, page=page)) + "\n")
+        self.stream.flush()
+        line = self.stream.readline()
+        if not line:
+            print("The plot server closed the connection")
+            sys.exit(-1)
+        response = json.loads(line)
+        if response["error"] is not None:
+            print(response["error"])
+            sys.exit(-1)
+        return response
+
+    def get(self,index):
+        """
+        get the plot of a page from the server
+        :param index: the index of the page
+        :return: the contents of the plot
+        """
+        return self.send(index)["plot"]
+
+    def close(self):
+        self.stream.close()
+        self.connection.close()
+
+
+def open_dataset(path,backend="auto",layout=None):
+    """
+    open a file to plot.  xarray is only imported if it is needed, as importing it can take longer than making a plot.
+    :param path: the path of the file
+    :param backend: "netcdf4" to read the file directly with the netCDF4 library, "xarray" to open it with xarray,
+                    or "auto" to use the netCDF4 library if it can read the file, otherwise xarray.  With "auto",
+                    .npy files and Zarr stores are read directly (see ArraySource)
+    :param layout: (shape,dtype,offset) to read a raw binary file, see ArraySource.openRaw (or None)
+    :return: a NetCDFSource, an ArraySource or an xarray dataset.  The backend and layout are recorded in its
+             encoding, next to the path of the file ("source"), as the values read depend on them
+    """
+    ds = None
+    if layout is not None:
+        ds = ArraySource.openRaw(path, *layout)
+    elif backend == "auto" and path.endswith(".npy"):
+        ds = ArraySource.openNpy(path)
+    elif backend == "auto" and (os.path.normpath(path).endswith(".zarr") or
+                                any(os.path.exists(os.path.join(path, name)) for name in ArraySource.zarr_metadata)):
+        ds = ArraySource.openZarr(path)
+    elif backend != "xarray":
+        try:
+            ds = NetCDFSource(path)
+        except (ImportError, OSError):
+            if backend == "netcdf4":
+                raise
+    if ds is None:
+        import xarray as xr
+        ds = xr.open_dataset(path)
+    ds.encoding.update({"backend": backend, "layout": layout})
+    return ds
+
+
+def batch_list_pages(path,options,variables,backend="auto",layout=None):
+    """
+    list the pages to plot for a file, for use in a batch process pool
+    :param path: the path of the file
+    :param options: dictionary of keyword arguments for TermPlotter
+    :param variables: the names of the variables to plot, or an empty list to plot all suitable variables
+    :param backend: how to open the file, see open_dataset
+    :param layout: (shape,dtype,offset) to read a raw binary file, see open_dataset (or None)
+    :return: (pages,error) where error is None, or a description of the error if the file could not be read
+    """
+    import contextlib
+    import io
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(messages), open_dataset(path,backend,layout) as ds:
+            return (TermPlotter(ds, **options).getPages(list(variables)), None)
+    except KeyError as ex:
+        return (None, "%s not found in %s" % (ex.args[0] if ex.args else "key", path))
+    except (Exception, SystemExit) as ex:
+        return (None, get_batch_error(messages.getvalue(), ex))
+
+
+def batch_plot_page(path,options,page,backend="auto",layout=None):
+    """
+    plot a page from a file, for use in a batch process pool
+    :param path: the path of the file
+    :param options: dictionary of keyword arguments for TermPlotter
+    :param page: the page to plot, from TermPlotter.getPages
+    :param backend: how to open the file, see open_dataset
+    :param layout: (shape,dtype,offset) to read raw binary files, see open_dataset (or None)
+    :return: (plot,error) where error is None, or a description of the error if the page could not be plotted
+    """
+    import contextlib
+    import io
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(messages), open_dataset(path,backend,layout) as ds:
+            missing = [var_name for var_name in ([page] if isinstance(page, str) else page) if var_name not in ds]
+            if missing:
+                return (None, "variable %s not found in %s" % (",".join(missing), path))
+            return (TermPlotter(ds, **options).plotPage(page), None)
+    except KeyError as ex:
+        return (None, "%s not found in %s" % (ex.args[0] if ex.args else "key", path))
+    except (Exception, SystemExit) as ex:
+        return (None, get_batch_error(messages.getvalue(), ex))
+
+
+def get_batch_error(messages,ex):
+    """
+    describe an error reading or plotting a file in batch mode
+    :param messages: the messages printed before the error
+    :param ex: the exception
+    :return: a description of the error
+    """
+    # TermPlotter prints the reason before exiting, other errors are described by the exception
+    error = messages.strip() + ("" if isinstance(ex, SystemExit) else " " + str(ex))
+    return error.strip() or "unable to plot"
+
+
+def run_batch(paths,options,variables,output_dir=None,output_format="ans",jobs=None,backend="auto",layout=None):
+    """
+    plot many files without a terminal, rendering each file and variable in a pool of processes.
+    Files that cannot be read or plotted are reported and skipped.
+    :param paths: the paths of the files to plot
+    :param options: dictionary of keyword arguments for TermPlotter
+    :param variables: the names of the variables to plot, or an empty list to plot all suitable variables
+    :param output_dir: directory to write a file for each plot to, or None to write all plots to stdout
+    :param output_format: the extension of the output files, "ans" or "txt"
+    :param jobs: the number of processes to use, or None to use all cores
+    :param backend: how to open the files, see open_dataset
+    :param layout: (shape,dtype,offset) to read raw binary files, see open_dataset (or None)
+    :return: the number of files or pages that could not be plotted
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    errors = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        listings = list(executor.map(batch_list_pages, paths, [options] * len(paths), [variables] * len(paths),
+                                     [backend] * len(paths), [layout] * len(paths)))
+
+        # queue every page of every file, then collect them in order
+        futures = []
+        for (path, (pages, error)) in zip(paths, listings):
+            if error is not None:
+                sys.stderr.write("ERROR %s: %s\n" % (path, error))
+                errors += 1
+                continue
+            for page in pages:
+                futures.append((path, page, executor.submit(batch_plot_page, path, options, page, backend,
+                                                                 layout)))
+
+        for (path, page, future) in futures:
+            page_name = "+".join(page) if isinstance(page, (list, tuple)) else page
+            (plot, error) = future.result()
+            if error is not None:
+                sys.stderr.write("ERROR %s:%s: %s\n" % (path, page_name, error))
+                errors += 1
+            elif output_dir is not None:
+                output_path = os.path.join(output_dir, "%s.%s.%s" % (os.path.basename(path), page_name, output_format))
+                with open(output_path, "w", encoding="utf-8") as f:
+                    f.write(plot + "\n")
+            else:
+                sys.stdout.write("==> %s:%s <==\n%s\n\n" % (path, page_name, plot))
+                sys.stdout.flush()
+    return errors
+
+
+def show_plots(plots,profiler=None):
+    """
+    print each plot, waiting for key presses if there are several plots
+    :param plots: a PlotPager or PlotClient
+    :param profiler: a PlotProfiler used to record the time taken to write each plot (or None)
+    """
+    import contextlib
+    if len(plots) == 0:
+        print("No variables found to plot")
+
+    index = 0
+    while index < len(plots):
+        TermPlotter.clearTerminal()
+        plot = plots.get(index)
+        with profiler.stage("write") if profiler is not None else contextlib.nullcontext():
+            print(plot, flush=True)
+        if len(plots) == 1:
+            break
+        c = TermPlotter.getKeyPress("Press Any Key (b for back, q to quit)>")
+        if c == 'q' or c == 'Q':
+            print("")
+            break
+        elif c == 'b' or c == 'B':
+            index = max(0, index - 1)
+        else:
+            index += 1
+    plots.close()
+
+
+def parse_memory_size(size):
+    """
+    parse a memory size such as 512M or 2G
+    :param size: a number of bytes, optionally followed by a K, M, G or T suffix
+    :return: the size in bytes
+    """
+    multipliers = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    size = size.strip().upper().rstrip("B")
+    if size and size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def parse_file_mode(mode):
+    """
+    parse file permissions such as 660
+    :param mode: the permissions in octal
+    :return: the permissions
+    """
+    mode = int(mode, 8)
+    if not 0 <= mode <= 0o777:
+        raise ValueError(mode)
+    return mode
+
+
+def parse_shape(shape):
+    """
+    parse the shape of an array such as 2000,4000
+    :param shape: the size of each dimension, separated by commas
+    :return: a tuple of sizes
+    """
+    sizes = tuple(int(size) for size in shape.split(","))
+    if any(size < 1 for size in sizes):
+        raise ValueError(shape)
+    return sizes
+
+
+def parse_tile_layout(layout):
+    """
+    parse a layout of tiles such as 2x2
+    :param layout: the number of rows and columns of tiles, separated by x
+    :return: (rows,columns)
+    """
+    (rows, _, columns) = layout.lower().partition("x")
+    if int(rows) < 1 or int(columns) < 1:
+        raise ValueError(layout)
+    return (int(rows), int(columns))
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Utility for plotting 2d data from netcdf4 file to a 256-colour terminal window. "+
+                    "Requires xarray+netcdf4.")
+    parser.add_argument("input_path", nargs="?",
+                help="path to a netcdf4 file, a numpy .npy file, a Zarr store or a raw binary file (see --raw-shape)")
+    parser.add_argument("-x", "--x-dimension", dest="x", metavar="<dimension>",
+                help="the dimension to plot on the x-axis",default="")
+    parser.add_argument("-y", "--y-dimension", dest="y", metavar="<dimension>",
+                help="the dimension to plot on the y-axis",default="")
+    parser.add_argument("-v", "--variable", dest="variables",
+                help="the variable name(s) to plot", nargs="+", metavar="<variable>", default=[])
+    parser.add_argument("--colour-map",
+                help="choose the colour map as a comma separated list of colours, "+
+                     "or \"rgb\" to combine three variables as red, green and blue channels", default="blue,green,red")
+    parser.add_argument("--missing-colour",
+                help="set the name of a colour to represent NaN values", default="black")
+    parser.add_argument("--plot-width",
+                help="set width of the plot in characters, by default uses the entire terminal width",type=int)
+    parser.add_argument("--plot-height",
+                help="set height of the plot in characters, by default uses the entire terminal height",type=int)
+    parser.add_argument("--min-value",
+                help="set minimum value on the colour scale",type=float)
+    parser.add_argument("--max-value",
+                help="set the maximum value on the colour scale",type=float)
+    parser.add_argument("--flip",action="store_true",
+                help="specify that the first rows in the image should appear at the top of the plot, not the bottom")
+    parser.add_argument("--nocheck", action="store_true",
+                help="ignore result of checking if the terminal supports 256 colours")
+    parser.add_argument("--fast", action="store_true",
+                help="read only a strided sample of the data, about one value per plotted cell. "+
+                     "Statistics are estimated from the sample")
+    parser.add_argument("--sample", type=int, metavar="STRIDE",
+                help="read only every STRIDE-th value along the x and y dimensions")
+    parser.add_argument("--max-memory", type=parse_memory_size, metavar="SIZE",
+                help="read and coarsen the data in blocks using at most SIZE bytes of memory, eg 512M or 2G")
+    parser.add_argument("--workers", type=int,
+                help="the number of threads used to read and coarsen blocks, by default uses all cores")
+    parser.add_argument("--cache", action="store_true",
+                help="store downsampled overviews of plotted variables on disk and reuse them in later plots")
+    parser.add_argument("--cache-dir", metavar="<directory>",
+                help="the directory used to store overviews, defaults to " + OverviewCache.default_directory)
+    parser.add_argument("--cache-size", type=parse_memory_size, metavar="SIZE",
+                help="the maximum size of the overview cache, eg 512M or 2G, least recently used overviews "+
+                     "are removed when the cache is full (default 1G)")
+    parser.add_argument("--cache-info", action="store_true",
+                help="list the contents of the overview cache and exit")
+    parser.add_argument("--cache-clear", action="store_true",
+                help="remove all overviews from the cache and exit")
+    parser.add_argument("--index", nargs="+", metavar="<dimension>=<index>", default=[],
+                help="the index to plot for dimensions other than x and y, which are otherwise plotted at index 0")
+    parser.add_argument("--animate", metavar="<dimension>",
+                help="animate the first variable along a dimension, such as time")
+    parser.add_argument("--fps", type=float, default=5,
+                help="the target number of frames per second when animating (default 5)")
+    parser.add_argument("--scale", default="linear", metavar="<scale>",
+                help="how values are mapped to colours: linear (default) from the minimum to the maximum value, "+
+                     "percentile:<low>,<high> (eg percentile:2,98) between two percentiles, clipping outliers, "+
+                     "or histeq to spread the values evenly over the colour scale")
+    parser.add_argument("--reduce", choices=Downsampler.reductions, default="mean",
+                help="how the values covered by each plotted cell are reduced to one value: the mean (default), "+
+                     "max or min of the values that are not missing, the nearest value to the centre of the cell, "+
+                     "or the mode, the most common value (for categorical data such as land/sea masks)")
+    parser.add_argument("--tile", type=parse_tile_layout, metavar="<rows>x<columns>",
+                help="plot several variables on each page in a grid of tiles, eg 2x2")
+    parser.add_argument("--shared-range", action="store_true",
+                help="when plotting in tiles, use the same colour scale range for every tile on a page")
+    parser.add_argument("--follow", action="store_true",
+                help="follow the first variable in a file that is still being written, showing the latest record "+
+                     "along the unlimited dimension as records are added")
+    parser.add_argument("--poll-interval", type=float, default=2, metavar="SECONDS",
+                help="in follow mode, the time between checks for new records (default 2)")
+    parser.add_argument("--interactive", action="store_true",
+                help="view the first variable interactively, with zooming and panning")
+    parser.add_argument("--encoding", choices=TermPlotter.encodings, default="plain",
+                help="how to encode the plot: plain (default), compact (fewer bytes, for slow connections), "+
+                     "halfblock (compact, with two rows of data in each row of text) or text (no colours)")
+    parser.add_argument("--encoding-stats", action="store_true",
+                help="report the size of the encoded plot, in bytes and bytes per cell")
+    parser.add_argument("--batch", nargs="+", metavar="<pattern>", default=[],
+                help="plot all files matching one or more glob patterns without using the terminal")
+    parser.add_argument("--file-list", metavar="<file>",
+                help="plot the files listed (one per line) in a file without using the terminal")
+    parser.add_argument("--output-dir", metavar="<directory>",
+                help="in batch mode, write each plot to a file <input>.<variable>.<format> in this directory, "+
+                     "instead of writing all plots to the standard output")
+    parser.add_argument("--format", choices=["ans","txt"], default="ans",
+                help="in batch mode, write plots with colours (ans) or as plain text characters (txt)")
+    parser.add_argument("--jobs", type=int,
+                help="in batch mode, the number of processes used to plot files, by default uses all cores")
+    parser.add_argument("--truecolour", action="store_true",
+                help="emit 24-bit colours instead of the closest colours in the 256 colour palette")
+    parser.add_argument("--backend", choices=["auto","netcdf4","xarray"], default="auto",
+                help="read files directly with the netCDF4 library, which starts faster, or with xarray, "+
+                     "which can read more formats.  By default uses netCDF4 if it can read the file")
+    parser.add_argument("--raw-shape", type=parse_shape, metavar="<size>,<size>",
+                help="read the input as a raw binary array with this shape, eg 2000,4000 (in row major order, the "+
+                     "last two dimensions are plotted as y and x)")
+    parser.add_argument("--raw-dtype", type=np.dtype, default=np.dtype("float32"), metavar="<dtype>",
+                help="the numpy data type of a raw binary array, eg float32 (default), int16 or >f8 for big endian")
+    parser.add_argument("--raw-offset", type=int, default=0, metavar="BYTES",
+                help="the number of bytes to skip at the start of a raw binary file, such as a header (default 0)")
+    parser.add_argument("--profile", action="store_true",
+                help="report the time taken and bytes read by each stage of plotting each variable")
+    parser.add_argument("--profile-format", choices=["table","json"], default="table",
+                help="report profiling as a summary table (default) or as JSON lines, one per stage")
+    parser.add_argument("--profile-output", metavar="<file>",
+                help="write the profiling report to a file instead of the standard error")
+    parser.add_argument("--serve", metavar="<socket>",
+                help="run a plot server listening on a Unix socket, which keeps recently used files open and "+
+                     "coarsened variables in memory for clients using --connect")
+    parser.add_argument("--server-datasets", type=int, metavar="N",
+                help="the maximum number of files the plot server keeps open (default %d)" %
+                     DatasetPool.default_max_open)
+    parser.add_argument("--server-memory", type=parse_memory_size, metavar="SIZE",
+                help="the maximum size of the coarsened variables the plot server keeps in memory, eg 512M or 2G "+
+                     "(default 512M)")
+    parser.add_argument("--server-mode", type=parse_file_mode, default=0o600, metavar="MODE",
+                help="the permissions of the plot server's socket in octal, eg 660 to allow the members of the "+
+                     "socket's group to connect (default 600, only the user running the server)")
+    parser.add_argument("--connect", metavar="<socket>",
+                help="ask the plot server listening on a Unix socket to make the plots, and display them")
+
+
+    args = parser.parse_args()
+
+    cache = None
+    if args.cache or args.cache_info or args.cache_clear:
+        cache = OverviewCache(args.cache_dir,args.cache_size)
+        if args.cache_clear:
+            cache.clear()
+        if args.cache_info:
+            print(cache.report())
+        if args.cache_info or args.cache_clear:
+            sys.exit(0)
+
+    if args.serve:
+        PlotServer(args.serve,args.server_datasets,args.server_memory,cache,args.server_mode).run()
+        sys.exit(0)
+
+    batch_paths = []
+    for pattern in args.batch:
+        import glob
+        batch_paths += sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+    if args.file_list:
+        with open(args.file_list) as f:
+            batch_paths += [line.strip() for line in f if line.strip()]
+
+    if args.input_path is None and not batch_paths:
+        parser.error("the following arguments are required: input_path")
+
+    if args.tile and (args.colour_map == "rgb" or args.interactive or args.animate or args.follow):
+        parser.error("--tile cannot be combined with the rgb colour map, --interactive, --animate or --follow")
+    if args.shared_range and args.scale == "histeq":
+        parser.error("--shared-range cannot be combined with --scale histeq")
+    if args.connect and (batch_paths or args.interactive or args.animate or args.follow or args.profile or args.cache):
+        parser.error("--connect cannot be combined with batch mode, --interactive, --animate, --follow, --profile "+
+                     "or --cache (start the server with --cache to use the overview cache)")
+
+    # the raw binary layout is passed as plain values, so that it can be sent to batch processes and plot servers
+    layout = (args.raw_shape, args.raw_dtype.str, args.raw_offset) if args.raw_shape else None
+
+    indices = {}
+    for index_arg in args.index:
+        (dimension, _, index) = index_arg.partition("=")
+        try:
+            indices[dimension] = int(index)
+        except ValueError:
+            parser.error("--index should be specified as <dimension>=<index>, not %s" % index_arg)
+
+    # keyword arguments for TermPlotter, for plotting in batch mode or by a plot server
+    options = {"colour_map": args.colour_map, "missing_colour": args.missing_colour,
+               "x_dimension": args.x, "y_dimension": args.y,
+               "plot_width": args.plot_width, "plot_height": args.plot_height,
+               "min_value": args.min_value, "max_value": args.max_value, "flip": not args.flip,
+               "truecolour": args.truecolour, "fast": args.fast, "sample_stride": args.sample,
+               "max_memory": args.max_memory, "workers": args.workers, "indices": indices,
+               "encoding": args.encoding, "encoding_stats": args.encoding_stats,
+               "tiles": args.tile, "shared_range": args.shared_range, "scale": args.scale, "reduction": args.reduce}
+
+    if batch_paths:
+        if args.profile:
+            parser.error("--profile is not supported in batch mode")
+        if args.input_path is not None:
+            batch_paths.insert(0, args.input_path)
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        options.update({"plot_width": args.plot_width if args.plot_width else 80,
+                        "plot_height": args.plot_height if args.plot_height else 24, "cache": cache,
+                        "encoding": "text" if args.format == "txt" else args.encoding})
+        errors = run_batch(batch_paths,options,args.variables,args.output_dir,args.format,args.jobs,args.backend,
+                           layout)
+        sys.exit(1 if errors else 0)
+
+    if args.truecolour:
+        if os.getenv("COLORTERM") not in ["truecolor","24bit"]:
+            print(("WARNING: " if args.nocheck else "ERROR: ") + "terminal does not appear to support 24-bit colours.")
+            if not args.nocheck:
+                sys.exit(-1)
+    elif os.getenv("TERM") != "xterm-256color":
+        print(("WARNING: " if args.nocheck else "ERROR: ") + "terminal does not appear to support 256 colours.")
+        if not args.nocheck:
+            sys.exit(-1)
+
+    if args.connect:
+        # the plot is sized to this terminal, not the server's
+        import shutil
+        tsize = shutil.get_terminal_size()
+        options.update({"plot_width": args.plot_width if args.plot_width else tsize.columns - 1,
+                        "plot_height": args.plot_height if args.plot_height else tsize.lines - 2})
+        show_plots(PlotClient(args.connect, {"path": os.path.abspath(args.input_path), "backend": args.backend,
+                                             "layout": layout, "variables": args.variables, "options": options}))
+        sys.exit(0)
+
+    profiler = PlotProfiler() if args.profile else None
+
+    def reportProfile():
+        if profiler is None:
+            return
+        if args.profile_output:
+            with open(args.profile_output, "w") as f:
+                f.write(profiler.report(args.profile_format) + "\n")
+        else:
+            sys.stderr.write(profiler.report(args.profile_format) + "\n")
+
+    if profiler is not None:
+        with profiler.stage("open"):
+            ds = open_dataset(args.input_path,args.backend,layout)
+    else:
+        ds = open_dataset(args.input_path,args.backend,layout)
+
+    tp = TermPlotter(ds,args.colour_map,args.missing_colour,
+                     args.x,args.y,
+                     args.plot_width,args.plot_height,
+                     args.min_value,args.max_value,
+                     not args.flip,args.truecolour,
+                     args.fast,args.sample,
+                     args.max_memory,args.workers,cache,
+                     indices,args.encoding,args.encoding_stats,
+                     profiler,args.tile,args.shared_range,args.scale,reduction=args.reduce)
+
+    if args.interactive:
+        pages = tp.getPages(args.variables)
+        if len(pages) == 0 or isinstance(pages[0], list):
+            print("No variable found to view")
+            sys.exit(-1)
+        PlotViewer(tp,pages[0]).run()
+        reportProfile()
+        sys.exit(0)
+
+    if args.follow:
+        pages = tp.getPages(args.variables)
+        if len(pages) == 0 or isinstance(pages[0], list):
+            print("No variable found to follow")
+            sys.exit(-1)
+        unlimited_dims = [dim for dim in ds[pages[0]].dims if dim in ds.encoding.get("unlimited_dims", ())]
+        if not unlimited_dims:
+            print("Variable %s does not have an unlimited dimension" % pages[0])
+            sys.exit(-1)
+        PlotFollower(tp,pages[0],unlimited_dims[0],args.input_path,args.backend,args.poll_interval).run()
+        reportProfile()
+        sys.exit(0)
+
+    if args.animate:
+        pages = tp.getPages(args.variables)
+        if len(pages) == 0 or isinstance(pages[0], list):
+            print("No variable found to animate")
+            sys.exit(-1)
+        if args.animate not in ds[pages[0]].dims:
+            print("Variable %s does not have dimension %s" % (pages[0], args.animate))
+            sys.exit(-1)
+        animator = PlotAnimator(tp,pages[0],args.animate,args.fps)
+        animator.play()
+        print(animator.report())
+        reportProfile()
+        sys.exit(0)
+
+    # pages are rendered on demand, the next pages are rendered in the background while a page is displayed
+    show_plots(PlotPager(tp,tp.getPages(args.variables)),profiler)
+    reportProfile()
 
 
 
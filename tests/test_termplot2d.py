@@ -0,0 +1,264 @@
+import json
+import math
+import os
+import socket
+import sys
+import threading
+
+import numpy as np
+import pytest
+import xarray as xr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from termplot2d import (ArrayCache, Downsampler, OverviewCache, PlotServer, PlotViewer, TermPlotter,  # noqa: E402
+                        open_dataset)
+
+
+def make_dataset(height=60,width=120,times=3,dtype=np.float32):
+    """
+    make a small dataset with a smooth field, some missing values and a variable without the time dimension
+    """
+    rng = np.random.default_rng(0)
+    field = np.cumsum(np.cumsum(rng.normal(size=(times, height, width)), axis=1), axis=2).astype(dtype)
+    field[:, 5:12, 20:40] = np.nan
+    return xr.Dataset({"sst": (("time", "lat", "lon"), field),
+                       "mask": (("lat", "lon"), (field[0] > 0).astype(dtype))},
+                      coords={"time": np.arange(times), "lat": np.linspace(-89, 89, height),
+                              "lon": np.linspace(-179, 179, width)})
+
+
+def make_plotter(ds,plot_width=60,plot_height=30,**kwargs):
+    return TermPlotter(ds, "blue,green,red", "black", "lon", "lat", plot_width, plot_height, None, None, True, **kwargs)
+
+
+def reference_plot(tp,ds,var_name):
+    """
+    plot a variable with the original per-cell rendering loop, coarsening with xarray, for plot sizes that divide
+    the size of the variable
+    """
+    arr = ds[var_name].isel({dim: 0 for dim in ds[var_name].dims if dim not in ("lat", "lon")})
+    (height, width) = arr.shape
+    nan_fraction = np.count_nonzero(np.isnan(arr.data)) / arr.size
+    window_size_x = math.ceil(width / tp.plot_width)
+    window_size_y = math.ceil(height / tp.plot_height)
+    if window_size_x > 1 or window_size_y > 1:
+        arr = arr.coarsen({"lat": window_size_y, "lon": window_size_x}, boundary="pad").mean(skipna=True)
+    arr = arr.data
+    (minval, maxval) = (np.nanmin(arr), np.nanmax(arr))
+    data = np.flipud((arr - minval) / (maxval - minval))
+
+    s = ""
+    for y in range(data.shape[0]):
+        last_code = None
+        for x in range(data.shape[1]):
+            v = data[y, x]
+            code = tp.missing_colour_code if math.isnan(v) else tp.getColourCode(math.floor(len(tp.colour_scale) * v))
+            if last_code is not None and code == last_code:
+                s += " "
+            else:
+                s += tp.getColourBGString(code)
+                last_code = code
+        s += TermPlotter.reset_escape_code + "\n"
+    cbar = "".join(tp.getColourBGString(tp.getColourCode(index)) for index in range(len(tp.colour_scale)))
+    s += "%s (w:%d,h:%d) [%f %s %f] [missing: %.3f%% %s]" % (
+        var_name, width, height, minval, cbar + TermPlotter.reset_escape_code, maxval, 100 * nan_fraction,
+        tp.getColourBGString(tp.missing_colour_code, s=" ", reset=True))
+    return s
+
+
+def plot_rows(plot):
+    """
+    the rendered rows of a plot, without the label
+    """
+    return plot.rsplit("\n", 1)[0]
+
+
+@pytest.fixture
+def netcdf_path(tmp_path):
+    path = str(tmp_path / "field.nc")
+    make_dataset().to_netcdf(path)
+    return path
+
+
+@pytest.mark.parametrize("size", [(120, 60), (60, 30), (40, 20)])
+def test_default_output_matches_reference(size):
+    # xarray sums float32 values in a different order, so compare float64 values
+    ds = make_dataset(dtype=np.float64)
+    tp = make_plotter(ds, *size)
+    for var_name in ("sst", "mask"):
+        assert tp.plot([var_name])[0] == reference_plot(tp, ds, var_name)
+
+
+@pytest.mark.parametrize("options", [{}, {"max_memory": 4096, "workers": 2}, {"fast": True},
+                                     {"reduction": "max"}, {"encoding": "halfblock"}])
+def test_read_paths_agree(tmp_path,netcdf_path,options):
+    expected = make_plotter(make_dataset(), 50, 25, **options).plot(["sst"])
+    for backend in ("xarray", "netcdf4"):
+        with open_dataset(netcdf_path, backend) as ds:
+            assert make_plotter(ds, 50, 25, **options).plot(["sst"]) == expected
+
+    # arrays read directly are named after the file, with dimensions named y and x
+    field = make_dataset()["sst"].values[0]
+    np.save(str(tmp_path / "sst.npy"), field)
+    field.tofile(str(tmp_path / "sst.raw"))
+    sources = [(str(tmp_path / "sst.npy"), None), (str(tmp_path / "sst.raw"), ((60, 120), "<f4", 0))]
+    for (path, layout) in sources:
+        with open_dataset(path, "auto", layout) as ds:
+            tp = TermPlotter(ds, "blue,green,red", "black", "x", "y", 50, 25, None, None, True, **options)
+            assert plot_rows(tp.plot(["sst"])[0]) == plot_rows(expected[0])
+
+
+def test_zarr_read_path_agrees(tmp_path):
+    zarr = pytest.importorskip("zarr")
+    field = make_dataset()["sst"].values[0]
+    array = zarr.open_array(str(tmp_path / "sst.zarr"), mode="w", shape=field.shape, chunks=(16, 120),
+                            dtype=field.dtype)
+    array[:] = field
+    array.attrs["_ARRAY_DIMENSIONS"] = ["lat", "lon"]
+    expected = make_plotter(make_dataset(), 50, 25).plot(["sst"])
+    with open_dataset(str(tmp_path / "sst.zarr")) as ds:
+        assert plot_rows(make_plotter(ds, 50, 25, max_memory=4096).plot(["sst"])[0]) == plot_rows(expected[0])
+
+
+@pytest.mark.parametrize("size,cells", [(10, 3), (120, 50), (121, 60), (7, 7), (5, 9)])
+def test_downsampler_edges_fill_the_plot(size,cells):
+    edges = Downsampler.getEdges(size, cells)
+    windows = np.diff(edges)
+    assert edges[0] == 0 and edges[-1] == size
+    assert len(windows) == min(size, cells)
+    assert windows.min() >= 1 and windows.max() - windows.min() <= 1
+
+
+def test_downsampler_mean_in_blocks():
+    rng = np.random.default_rng(1)
+    data = rng.normal(size=(47, 83))
+    data[rng.random(data.shape) < 0.2] = np.nan
+    downsampler = Downsampler("mean", Downsampler.getEdges(47, 10), Downsampler.getEdges(83, 20))
+    (nan_count, whole) = downsampler.downsample(data)
+    (block_nan_count, blocks) = downsampler.combine([downsampler.reduce(data[start:start + 7], start)
+                                                     for start in range(0, 47, 7)])
+    expected = np.array([[np.nanmean(data[y0:y1, x0:x1]) for (x0, x1) in zip(downsampler.edges_x[:-1],
+                                                                             downsampler.edges_x[1:])]
+                         for (y0, y1) in zip(downsampler.edges_y[:-1], downsampler.edges_y[1:])])
+    assert nan_count == block_nan_count == np.count_nonzero(np.isnan(data))
+    np.testing.assert_allclose(whole, expected)
+    np.testing.assert_allclose(blocks, expected)
+
+
+@pytest.mark.parametrize("encoding", TermPlotter.encodings)
+def test_encodings(encoding):
+    ds = make_dataset()
+    tp = make_plotter(ds, 40, 15, encoding=encoding)
+    (_, _, _, data, _, _) = tp.loadvar(ds, "sst")
+    codes = tp.getCodes(data)
+    rows = tp.renderCodes(codes).split("\n")[:-1]
+    assert codes.shape == (15 * tp.cell_rows, 40)
+    assert len(rows) == 15
+    if encoding == "text":
+        assert all(len(row) == 40 for row in rows)
+        assert " " in "".join(rows)
+
+
+def test_viewer_fills_the_plot():
+    ds = make_dataset(240, 400)
+    tp = make_plotter(ds, 90, 50)
+    viewer = PlotViewer(tp, "sst")
+    for _ in range(4):
+        (view, _, _, cells_y, cells_x) = viewer.getView()
+        assert view.shape == (50, 90)
+        viewer.zoomIn()
+    viewer.reset()
+    # the unzoomed view shows the same cells as the static plot
+    (_, minval, maxval, data, _, _) = tp.loadvar(ds, "sst")
+    (view, _, _, _, _) = viewer.getView()
+    assert np.array_equal(tp.getCodes(np.flipud((view - minval) / (maxval - minval))), tp.getCodes(data))
+
+
+def test_array_cache_key_changes():
+    path = __file__
+    key = ArrayCache.getKey(path, "sst", ("lat", "lon"), {"time": 0}, (1, 1), "mean", (30, 60))
+    assert key == ArrayCache.getKey(path, "sst", ("lat", "lon"), {"time": 0}, (1, 1), "mean", (30, 60))
+    changed = [ArrayCache.getKey(path, "sst", ("lon", "lat"), {"time": 0}, (1, 1), "mean", (30, 60)),
+               ArrayCache.getKey(path, "sst", ("lat", "lon"), {"time": 1}, (1, 1), "mean", (30, 60)),
+               ArrayCache.getKey(path, "sst", ("lat", "lon"), {"time": 0}, (1, 1), "max", (30, 60)),
+               ArrayCache.getKey(path, "sst", ("lat", "lon"), {"time": 0}, (1, 1), "mean", (30, 60), "xarray"),
+               ArrayCache.getKey(path, "sst", ("lat", "lon"), {"time": 0}, (1, 1), "mean", (30, 60), "auto",
+                                 ((60, 120), "<f4", 0))]
+    assert key not in changed and len(set(changed)) == len(changed)
+
+
+def test_overview_cache_key_changes(tmp_path):
+    cache = OverviewCache(str(tmp_path))
+    path = __file__
+    (key, _) = cache.getKey(path, "sst", ("lat", "lon"), {"time": 0})
+    changed = [cache.getKey(path, "sst", ("lon", "lat"), {"time": 0})[0],
+               cache.getKey(path, "sst", ("lat", "lon"), {"time": 1})[0],
+               cache.getKey(path, "sst", ("lat", "lon"), {"time": 0}, "xarray")[0],
+               cache.getKey(path, "sst", ("lat", "lon"), {"time": 0}, "auto", ((60, 120), "<f4", 0))[0],
+               cache.getKey(path, "sst", ("lat", "lon"), {"time": 0}, "auto", ((120, 60), "<f4", 0))[0]]
+    assert key not in changed and len(set(changed)) == len(changed)
+
+
+def test_caches_miss_when_the_layout_or_dimensions_change(tmp_path):
+    # the same raw file read with two layouts, and the same variable plotted with x and y swapped
+    path = str(tmp_path / "r.raw")
+    (np.arange(24000, dtype=np.float32) * 0.5 + 1000).tofile(path)
+    cases = [(((120, 200), "<f4", 0), "x", "y"), (((200, 120), "<f4", 0), "x", "y"), (((200, 120), "<f4", 0), "y", "x")]
+    overview_cache = OverviewCache(str(tmp_path / "cache"))
+    array_cache = ArrayCache()
+    for caches in ({"cache": overview_cache}, {"array_cache": array_cache}):
+        for _ in range(2):
+            for (layout, x_dimension, y_dimension) in cases:
+                with open_dataset(path, "auto", layout) as ds:
+                    expected = TermPlotter(ds, "blue,green,red", "black", x_dimension, y_dimension, 50, 25, None, None,
+                                           True).plot(["r"])
+                    cached = TermPlotter(ds, "blue,green,red", "black", x_dimension, y_dimension, 50, 25, None, None,
+                                         True, **caches).plot(["r"])
+                assert cached == expected
+    assert len(overview_cache.list()) == len(cases)
+
+
+def test_index_selection(netcdf_path):
+    with open_dataset(netcdf_path) as ds:
+        tp = make_plotter(ds)
+        (arr, fixed_indices) = tp.selectvar(ds, "sst", {"time": -1})
+        assert fixed_indices == {"time": 2}
+        # an index for a dimension of another variable in the file applies only to variables with that dimension
+        (arr, fixed_indices) = tp.selectvar(ds, "mask", {"time": 1})
+        assert fixed_indices == {}
+        for indices in ({"time": 3}, {"time": -4}, {"depth": 0}):
+            with pytest.raises(SystemExit):
+                tp.selectvar(ds, "sst", indices)
+
+
+def test_server_protocol(netcdf_path):
+    server = PlotServer("unused.sock")
+    (client, connection) = socket.socketpair()
+    thread = threading.Thread(target=server.handle, args=(connection,))
+    thread.start()
+    options = {"colour_map": "blue,green,red", "missing_colour": "black", "x_dimension": "lon",
+               "y_dimension": "lat", "plot_width": 50, "plot_height": 25, "min_value": None, "max_value": None,
+               "flip": True}
+    requests = [{"path": netcdf_path, "variables": ["sst"], "options": options, "page": None},
+                {"path": netcdf_path, "variables": ["sst"], "options": options, "page": 0},
+                {"path": netcdf_path, "variables": ["sst"], "options": options, "page": 0},
+                {"path": netcdf_path, "variables": ["nope"], "options": options, "page": 0},
+                "not a request"]
+    with client, client.makefile("rw", encoding="utf-8") as stream:
+        responses = []
+        for request in requests:
+            stream.write(json.dumps(request) + "\n")
+            stream.flush()
+            responses.append(json.loads(stream.readline()))
+    thread.join()
+    server.datasets.close()
+
+    with open_dataset(netcdf_path) as ds:
+        expected = make_plotter(ds, 50, 25).plot(["sst"])[0]
+    assert responses[0]["pages"] == 1 and responses[0]["plot"] is None
+    assert responses[1]["plot"] == expected and responses[1]["error"] is None
+    assert responses[2]["plot"] == expected
+    assert server.array_cache.hits == 1
+    assert responses[3]["error"] and responses[3]["plot"] is None
+    assert responses[4]["error"] == "request not recognized"